@@ -0,0 +1,103 @@
+"""
+Benchmarks matrix-heavy calculations on the worker pool with different BLAS thread caps.
+
+Every configuration runs in a fresh interpreter, because the thread cap is read by
+numpy when the worker (or the forkserver template) first imports it.
+
+    python scripts/benchmark_worker_threads.py
+    python scripts/benchmark_worker_threads.py --workers 5 --jobs 40 --size 600
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Add the parent directory to sys.path to allow imports from src
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SCRIPT = """import numpy as np
+a = np.random.default_rng(0).random((SIZE, SIZE))
+for _ in range(5):
+    a = np.linalg.inv(np.dot(a, a.T) + np.eye(SIZE))
+results = {"trace": float(np.trace(a))}
+"""
+
+
+async def run_benchmark(workers: int, jobs: int, size: int) -> dict:
+    from src.core.execution import WorkerPool
+
+    pool = WorkerPool(workers)
+    try:
+        # Warm up every worker so start-up is not measured
+        await asyncio.gather(*(pool.execute("results = {}", timeout=60.0) for _ in range(workers)))
+        script = SCRIPT.replace("SIZE", str(size))
+
+        async def timed_job():
+            start = time.perf_counter()
+            result = await pool.execute(script, timeout=600.0)
+            if not result["success"]:
+                raise RuntimeError(result["error"])
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(timed_job() for _ in range(jobs)))
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.shutdown()
+
+    return {
+        "elapsed": elapsed,
+        "throughput": jobs / elapsed,
+        "latency_p50": statistics.median(latencies),
+        "latency_max": max(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=5)
+    parser.add_argument("--jobs", type=int, default=20)
+    parser.add_argument("--size", type=int, default=400)
+    parser.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        print(json.dumps(asyncio.run(run_benchmark(args.workers, args.jobs, args.size))))
+        return
+
+    configurations = [
+        ("library default", {"WORKER_NUM_THREADS": "0", "WORKER_CPU_AFFINITY": "false"}),
+        ("1 thread per worker", {"WORKER_NUM_THREADS": "1", "WORKER_CPU_AFFINITY": "false"}),
+        ("1 thread, pinned", {"WORKER_NUM_THREADS": "1", "WORKER_CPU_AFFINITY": "true"}),
+    ]
+    print(f"{args.workers} workers, {args.jobs} jobs, {args.size}x{args.size} matrices, {os.cpu_count()} CPUs\n")
+    print(f"{'configuration':<22}{'elapsed':>10}{'jobs/s':>10}{'p50':>10}{'max':>10}")
+    for name, overrides in configurations:
+        env = {**os.environ, **overrides, "WORKER_MAX_COUNT": str(args.workers)}
+        output = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--run",
+                f"--workers={args.workers}",
+                f"--jobs={args.jobs}",
+                f"--size={args.size}",
+            ],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        r = json.loads(output.strip().splitlines()[-1])
+        print(
+            f"{name:<22}{r['elapsed']:>9.2f}s{r['throughput']:>10.2f}{r['latency_p50']:>9.2f}s{r['latency_max']:>9.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,13 @@
 import uuid
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, Request
 from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..core.calculation_service import get_input_overrides, run_calculation
+from ..core.auth import get_current_user
+from ..core.calculation_service import get_input_overrides, run_calculation, run_cancellable
 from ..core.database import get_db
 from ..core.generator import CodeGenerator
 from ..models.sheet import Connection, Node, Sheet
@@ -20,15 +21,21 @@ class PreviewRequest(BaseModel):
     graph: SheetCreate
 
 
+# Namespace for the ids of preview sheets, which are derived from their graph
+PREVIEW_NAMESPACE = uuid.UUID("6f1c2e0a-5b7d-4c3e-9a8f-2d4b6e8a0c1e")
+
+
 def construct_sheet(body: PreviewRequest) -> Sheet:
-    sheet_id = uuid.uuid4()
+    # The id ends up in the generated code, so the same graph must always get the same one,
+    # otherwise every preview would be compiled (and never coalesced) as a new sheet
+    sheet_id = uuid.uuid5(PREVIEW_NAMESPACE, body.graph.model_dump_json())
     nodes = []
-    for n in body.graph.nodes:
+    for index, n in enumerate(body.graph.nodes):
         # Use mode='json' to ensure nested Pydantic models (like data) are converted to dicts
         # for SQLAlchemy JSONB columns.
         node_data = n.model_dump(mode="json")
         if not node_data.get("id"):
-            node_data["id"] = uuid.uuid4()
+            node_data["id"] = uuid.uuid5(sheet_id, str(index))
         nodes.append(Node(**node_data, sheet_id=sheet_id))
 
     connections = []
@@ -49,10 +56,16 @@ def construct_sheet(body: PreviewRequest) -> Sheet:
 @router.post("/")
 async def calculate_preview(
     body: PreviewRequest,
+    request: Request,
+    profile: bool = False,
+    session_id: Optional[str] = Header(None, alias="X-Calculation-Session"),
+    user_id: Optional[str] = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
     sheet = await run_in_threadpool(construct_sheet, body)
-    return await run_calculation(sheet, body.inputs, db)
+    # Edits change the preview sheet's id; the editor session is what stays the same
+    calculation = run_calculation(sheet, body.inputs, db, affinity=session_id, profile=profile)
+    return await run_cancellable(request, calculation, session_id, user_id)
 
 
 @router.post("/script")
@@ -2,7 +2,7 @@ from datetime import datetime, timedelta
 from typing import Any, Dict
 from uuid import UUID, uuid4
 
-from fastapi import APIRouter, Body, Depends, HTTPException
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Request
 from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import PlainTextResponse
 from sqlalchemy import or_, select, text, update
@@ -11,7 +11,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import defer, selectinload
 
 from ..core.auth import get_current_user
-from ..core.calculation_service import run_calculation
+from ..core.calculation_service import run_calculation, run_cancellable
 from ..core.config import settings
 from ..core.database import get_db
 from ..core.generator import CodeGenerator
@@ -40,7 +40,6 @@ from ..schemas.sheet import (
     SheetVersionRead,
     SheetVersionSummary,
 )
-from .calculate import PreviewRequest, construct_sheet
 
 router = APIRouter(prefix="/sheets", tags=["sheets"])
 
@@ -549,28 +548,33 @@ async def generate_script_sheet(
 @router.post("/{sheet_id}/calculate")
 async def calculate_sheet(
     sheet_id: UUID,
+    request: Request,
     version_id: UUID | None = None,
+    profile: bool = False,
     inputs: Dict[str, Dict[str, Any]] = Body(None),
+    session_id: str | None = Header(None, alias="X-Calculation-Session"),
+    user_id: str | None = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
     if inputs is None:
         inputs = {}
 
     if version_id:
-        # 1. Fetch Version
-        v_query = select(SheetVersion).where(SheetVersion.id == version_id, SheetVersion.sheet_id == sheet_id)
+        # 1. Fetch Version, with the name of its sheet
+        v_query = (
+            select(SheetVersion, Sheet.name)
+            .join(Sheet, SheetVersion.sheet_id == Sheet.id)
+            .where(SheetVersion.id == version_id, SheetVersion.sheet_id == sheet_id)
+        )
         v_res = await db.execute(v_query)
-        version = v_res.scalar_one_or_none()
-        if not version:
+        row = v_res.first()
+        if not row:
             raise HTTPException(status_code=404, detail="Version not found")
 
-        # 2. Construct transient Sheet object for runner
-        # We wrap data in a PreviewRequest-like structure to reuse _construct_sheet
-        mock_body = PreviewRequest(
-            graph={"name": "Snapshot", "nodes": version.data["nodes"], "connections": version.data["connections"]},
-            inputs=inputs,
-        )
-        sheet = await run_in_threadpool(construct_sheet, mock_body)
+        # 2. Rebuild it exactly as when it is embedded in another sheet, so the class is
+        # tagged with the version (trusted versions, persisted bytecode) and shared between both
+        version, sheet_name = row
+        sheet = await run_in_threadpool(CodeGenerator.sheet_from_version, version, sheet_name)
     else:
         # Default: Calculate Draft
         query = (
@@ -584,7 +588,15 @@ async def calculate_sheet(
         if not sheet:
             raise HTTPException(status_code=404, detail="Sheet not found")
 
-    return await run_calculation(sheet, inputs, db)
+    calculation = run_calculation(
+        sheet,
+        inputs,
+        db,
+        affinity=str(version_id or sheet_id),
+        profile=profile,
+        version_id=str(version_id) if version_id else None,
+    )
+    return await run_cancellable(request, calculation, session_id, user_id)
 
 
 @router.get("/{sheet_id}/usages")
@@ -1,4 +1,5 @@
-from typing import Any, Dict, List
+import asyncio
+from typing import Any, Awaitable, Dict, Iterable, List
 from uuid import UUID
 
 import numpy as np
@@ -7,14 +8,34 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
+from ..core.config import settings
 from ..core.database import get_db
-from ..core.execution import execute_full_script
+from ..core.execution import BATCH, execute_prepared, prepare_sheet, release_result
 from ..core.generator import CodeGenerator
+from ..core.metrics import observe_timings, timed
 from ..core.utils import serialize_result
 from ..models.sheet import Connection, Node, Sheet, SheetVersion
 from ..schemas.sweep import SweepHeader, SweepRequest, SweepResponse
 
 
+async def run_chunks(calls: Iterable[Awaitable[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Runs the chunk calculations concurrently. If one fails, the others are cancelled, freeing
+    their workers, and the results that did arrive are released before the error propagates.
+    """
+    tasks = [asyncio.ensure_future(call) for call in calls]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for task in tasks:
+            if not task.cancelled() and task.exception() is None:
+                release_result(task.result())
+        raise
+
+
 def generate_values(start: str | None, end: str | None, step: str | None, manual: List[str] | None) -> List[Any]:
     if manual is not None:
         return manual
@@ -182,53 +203,80 @@ async def sweep_sheet(
     output_ids_str = [str(oid) for oid in body.output_node_ids]
 
     global_error = None
+    timings: Dict[str, float] = {}
     results_rows: List[List[Any]] = []
     metadata_rows: List[Dict[str, Any]] = []
 
     try:
-        script = await generator.generate_sweep_script(
-            root_sheet=sheet, scenarios=scenarios, static_overrides=static_overrides, output_node_ids=output_ids_str
+        with timed(timings, "generate"):
+            definitions, entry_point = await generator.generate_prepared_sweep(
+                root_sheet=sheet, static_overrides=static_overrides, output_node_ids=output_ids_str
+            )
+            handle = prepare_sheet(definitions, entry_point)
+        observe_timings(timings)
+
+        # Chunks run as batch jobs: they use idle workers in parallel, and
+        # interactive calculations are dispatched ahead of the remaining chunks
+        chunk_size = max(1, settings.SWEEP_CHUNK_SIZE)
+        chunks = [scenarios[i : i + chunk_size] for i in range(0, len(scenarios), chunk_size)]
+        exec_results = await run_chunks(
+            execute_prepared(
+                handle,
+                {"scenarios": chunk},
+                timeout=30.0 + (len(chunk) * 0.05),
+                lane=BATCH,
+                affinity=str(sheet.id),
+            )
+            for chunk in chunks
         )
 
-        # Extend timeout for 2D sweeps
-        timeout = 30.0 + (len(scenarios) * 0.05)
-        exec_result = await execute_full_script(script, timeout=timeout)
-
-        if not exec_result.get("success"):
-            global_error = exec_result.get("error")
-
-        raw_results = exec_result.get("results", [])
-        if not isinstance(raw_results, list):
+        try:
             raw_results = []
-
-        for step in raw_results:
-            step_inputs = step.get("inputs", {})
-            step_outputs = step.get("outputs", {})
-            step_metadata = step.get("metadata", {})
-
-            # If the step itself had a top-level error (e.g. timeout or hard crash), ensure it's in metadata
-            if "error" in step and "error" not in step_metadata:
-                step_metadata["error"] = step["error"]
-
-            row = []
-            # 1. Primary Input
-            row.append(serialize_result(step_inputs.get(str(body.input_node_id))))
-
-            # 2. Secondary Input
-            if body.secondary_input_node_id:
-                row.append(serialize_result(step_inputs.get(str(body.secondary_input_node_id))))
-
-            # 3. Outputs
-            for oid in output_ids_str:
-                row.append(serialize_result(step_outputs.get(oid)))
-
-            results_rows.append(row)
-            metadata_rows.append(step_metadata)
+            for exec_result in exec_results:
+                for phase, seconds in exec_result.get("timings", {}).items():
+                    timings[phase] = timings.get(phase, 0.0) + seconds
+                if not exec_result.get("success") and global_error is None:
+                    global_error = exec_result.get("error")
+                chunk_results = exec_result.get("results", [])
+                if isinstance(chunk_results, list):
+                    raw_results.extend(chunk_results)
+
+            for step in raw_results:
+                step_inputs = step.get("inputs", {})
+                step_outputs = step.get("outputs", {})
+                step_metadata = step.get("metadata", {})
+
+                # If the step itself had a top-level error (e.g. timeout or hard crash), ensure it's in metadata
+                if "error" in step and "error" not in step_metadata:
+                    step_metadata["error"] = step["error"]
+
+                row = []
+                # 1. Primary Input
+                row.append(serialize_result(step_inputs.get(str(body.input_node_id))))
+
+                # 2. Secondary Input
+                if body.secondary_input_node_id:
+                    row.append(serialize_result(step_inputs.get(str(body.secondary_input_node_id))))
+
+                # 3. Outputs
+                for oid in output_ids_str:
+                    row.append(serialize_result(step_outputs.get(oid)))
+
+                results_rows.append(row)
+                metadata_rows.append(step_metadata)
+        finally:
+            # Large arrays are views onto shared memory; they are serialized by now
+            for exec_result in exec_results:
+                release_result(exec_result)
 
     except Exception as e:
         global_error = str(e)
         print(f"Sweep generation failed: {e}")
 
     return SweepResponse(
-        headers=headers, results=results_rows, metadata=metadata_rows if metadata_rows else None, error=global_error
+        headers=headers,
+        results=results_rows,
+        metadata=metadata_rows if metadata_rows else None,
+        error=global_error,
+        timings=timings,
     )
@@ -1,14 +1,39 @@
-from typing import Any, Dict
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
 
+from fastapi import HTTPException, Request
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
 from ..models.sheet import Sheet
-from .execution import execute_full_script
+from .execution import execute_prepared, prepare_sheet, release_result
 from .generator import CodeGenerator
+from .metrics import observe_timings, timed
 from .utils import serialize_result
 
+T = TypeVar("T")
+
+DISCONNECT_POLL_SECONDS = 0.1
+
+# Latest calculation per user and editor session; a newer one cancels the previous
+_session_calculations: Dict[Tuple[Optional[str], str], asyncio.Task] = {}
+
+
+class _Flight:
+    """An execution and enrichment shared by identical concurrent calculations."""
+
+    def __init__(self, task: asyncio.Task, db: AsyncSession):
+        self.task = task
+        self.db = db  # Session of the request that started it, used for enrichment
+        self.waiters = 0
+
+
+_flights: Dict[str, _Flight] = {}
+
 
 def get_input_overrides(sheet: Sheet, inputs: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
     # Map input labels/IDs to IDs
@@ -81,6 +106,11 @@ async def enrich_results(sheet: Sheet, raw_results: Dict[str, Any], db: AsyncSes
         if "is_computable" in res_data:
             node_resp["is_computable"] = res_data["is_computable"]
 
+        if res_data.get("stdout"):
+            node_resp["stdout"] = res_data["stdout"]
+        if res_data.get("cached"):
+            node_resp["cached"] = True
+
         val = res_data.get("value")
 
         # Populate inputs
@@ -114,11 +144,106 @@ async def enrich_results(sheet: Sheet, raw_results: Dict[str, Any], db: AsyncSes
             node_resp["outputs"] = {"value": val}
 
         detailed_results[node_id] = serialize_result(node_resp)
+        if res_data.get("profile"):
+            # Measurements rather than results, so they stay numbers
+            detailed_results[node_id]["profile"] = res_data["profile"]
 
     return detailed_results
 
 
-async def run_calculation(sheet: Sheet, inputs: Dict[str, Dict[str, Any]], db: AsyncSession):
+def collect_profile(results: Dict[str, Any], path: Tuple[str, ...] = ()) -> List[Dict[str, Any]]:
+    """Flattens the per-node profiles of enriched results, nested sheets included, slowest first."""
+    profile = []
+    for node_id, node_resp in results.items():
+        if node_resp.get("profile"):
+            profile.append(
+                {"node_id": node_id, "label": node_resp.get("label"), "path": list(path), **node_resp["profile"]}
+            )
+        if node_resp.get("nodes"):
+            profile.extend(collect_profile(node_resp["nodes"], (*path, node_resp.get("label") or node_id)))
+    if not path:
+        profile.sort(key=lambda entry: float(entry["wall_seconds"]), reverse=True)
+    return profile
+
+
+def calculation_key(handle: str, input_overrides: Dict[str, Any], sheet: Sheet) -> str:
+    """
+    Canonical hash of a calculation: the generated code (via its prepared handle) and the overrides.
+    Node labels and types are included because they appear in the enriched response but not all in the code.
+    """
+    overrides = json.dumps(input_overrides, sort_keys=True, default=repr)
+    nodes = json.dumps(sorted((str(n.id), n.type, n.label) for n in sheet.nodes), default=repr)
+    return hashlib.sha256(f"{handle}\0{overrides}\0{nodes}".encode()).hexdigest()
+
+
+async def _join_flight(key: str, start: Callable[[], Awaitable[Dict[str, Any]]], db: AsyncSession) -> Dict[str, Any]:
+    """
+    Waits for the calculation running under `key`, starting it if there is none.
+    It is cancelled only once every request waiting for it has gone.
+    """
+    flight = _flights.get(key)
+    if flight is None:
+        flight = _Flight(asyncio.ensure_future(start()), db)
+        _flights[key] = flight
+        flight.task.add_done_callback(lambda _: _flights.pop(key) if _flights.get(key) is flight else None)
+
+    flight.waiters += 1
+    try:
+        return await asyncio.shield(flight.task)
+    except asyncio.CancelledError:
+        if flight.waiters == 1:
+            flight.task.cancel()
+        elif flight.db is db:
+            # The others still need this request's database session
+            await asyncio.wait({flight.task})
+        raise
+    finally:
+        flight.waiters -= 1
+
+
+async def _execute_and_enrich(
+    sheet: Sheet,
+    handle: str,
+    input_overrides: Dict[str, Any],
+    db: AsyncSession,
+    affinity: Optional[str] = None,
+    profile: bool = False,
+) -> Dict[str, Any]:
+    timings: Dict[str, float] = {}
+    exec_result = await execute_prepared(handle, input_overrides, affinity=affinity, profile=profile)
+    try:
+        # Build detailed response recursively
+        with timed(timings, "enrich"):
+            detailed_results = await enrich_results(sheet, exec_result.get("results", {}), db)
+    finally:
+        # Large arrays are views onto shared memory; they are serialized by now
+        release_result(exec_result)
+    observe_timings(timings)
+
+    # Global script error?
+    error = exec_result.get("error") if not exec_result.get("success") else None
+
+    return {"results": detailed_results, "error": error, "timings": {**exec_result.get("timings", {}), **timings}}
+
+
+async def run_calculation(
+    sheet: Sheet,
+    inputs: Dict[str, Dict[str, Any]],
+    db: AsyncSession,
+    affinity: Optional[str] = None,
+    profile: bool = False,
+    version_id: Optional[str] = None,
+):
+    """
+    Calculates a sheet, or with `version_id` a sheet rebuilt from that version's snapshot.
+    Calculations with the same `affinity` key (e.g. the sheet id) return to the worker that has
+    the sheet's classes compiled and loaded; without one, the generated code is the key.
+    With `profile`, every node reports its wall time, CPU time and peak allocation, and the response
+    lists them all, slowest first.
+    """
+    started = time.perf_counter()
+    # Seconds spent here; merged with the phases reported by the worker pool
+    timings: Dict[str, float] = {}
     input_overrides = get_input_overrides(sheet, inputs)
 
     # Fill in missing inputs from 'example' values in the DB (Standalone defaults)
@@ -130,18 +255,66 @@ async def run_calculation(sheet: Sheet, inputs: Dict[str, Dict[str, Any]], db: A
                 if val is not None and val != "":
                     input_overrides[str(node.id)] = val
 
-    # Generate script
-    generator = CodeGenerator(db)
-    script = await generator.generate_full_script(sheet, input_overrides)
+    # Generate class definitions. The worker keeps them loaded under a handle,
+    # so recalculations only ship the input overrides.
+    with timed(timings, "generate"):
+        generator = CodeGenerator(db)
+        definitions, entry_point = await generator.generate_prepared_sheet(sheet, version_id)
+        handle = prepare_sheet(definitions, entry_point)
 
-    # Execute script
-    exec_result = await execute_full_script(script)
-    results = exec_result.get("results", {})
+    # Identical concurrent calculations (e.g. several viewers of a shared sheet)
+    # share one execution and one enrichment pass
+    key = calculation_key(handle, input_overrides, sheet)
+    if profile:
+        # Profiled runs are slower and return more; they are not shared with plain ones
+        key += ":profile"
+    calculation = await _join_flight(
+        key, lambda: _execute_and_enrich(sheet, handle, input_overrides, db, affinity, profile), db
+    )
+    timings["total"] = time.perf_counter() - started
+    # The pool and the shared run already recorded their own phases
+    observe_timings(timings)
 
-    # Build detailed response recursively
-    detailed_results = await enrich_results(sheet, results, db)
+    response = {**calculation, "timings": {**calculation["timings"], **timings}}
+    if profile:
+        response["profile"] = collect_profile(calculation["results"])
+    return response
 
-    # Global script error?
-    error = exec_result.get("error") if not exec_result.get("success") else None
 
-    return {"results": detailed_results, "error": error}
+async def run_cancellable(
+    request: Request, calculation: Awaitable[T], session_id: Optional[str] = None, user_id: Optional[str] = None
+) -> T:
+    """
+    Runs a calculation that is cancelled when the client disconnects or when a newer
+    calculation starts for the same editor session. Queued work is dropped and running
+    work is interrupted, so stale previews do not hold on to workers.
+    Sessions are scoped to the user, so nobody can cancel another user's calculation by sending their session id.
+    """
+    task = asyncio.ensure_future(calculation)
+    session_key = (user_id, session_id) if session_id else None
+    if session_key:
+        previous = _session_calculations.get(session_key)
+        if previous is not None:
+            previous.cancel()
+        _session_calculations[session_key] = task
+
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                break
+            if await request.is_disconnected():
+                task.cancel()
+                # Let it unwind before the request's database session is closed
+                await asyncio.wait({task})
+                raise HTTPException(status_code=499, detail="Client closed the request")
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        if session_key and _session_calculations.get(session_key) is task:
+            del _session_calculations[session_key]
+
+    if task.cancelled():
+        raise HTTPException(status_code=409, detail="Calculation was superseded by a newer request")
+    return task.result()
@@ -12,7 +12,26 @@ class Settings(BaseSettings):
     DB_ECHO: bool = False
     UPLOAD_DIR: str = "uploads"
     LOCK_TIMEOUT_SECONDS: int = 604800  # Time in seconds before a lock is considered stale (7 days)
-    WORKER_COUNT: int = 5
+    WORKER_COUNT: int = 5  # Workers started with the pool
+    WORKER_MIN_COUNT: int = 1
+    WORKER_MAX_COUNT: int = 10
+    WORKER_IDLE_TIMEOUT_SECONDS: float = 300.0  # Idle time before a worker above the minimum is retired
+    WORKER_SCALE_UP_QUEUE_DEPTH: int = 2  # Queued jobs that add a worker when all workers are busy
+    WORKER_SCALE_UP_WAIT_SECONDS: float = 0.5  # Queue wait that adds a worker when all workers are busy
+    WORKER_STANDBY_COUNT: int = 1  # Preloaded spare processes that replace killed or crashed workers
+    WORKER_INTERACTIVE_RESERVED: int = 1  # Workers that batch work (sweeps) never takes
+    WORKER_MAX_QUEUE_DEPTH: int = 50  # Queued interactive calculations before new ones are rejected; 0 disables
+    WORKER_MAX_QUEUE_WAIT_SECONDS: float = 10.0  # Estimated queue wait before new ones are rejected; 0 disables
+    WORKER_MAX_TASKS: int = 1000  # Tasks after which a worker process is recycled; 0 disables
+    WORKER_MAX_RSS_MB: int = 1024  # Resident memory after which a worker process is recycled; 0 disables
+    WORKER_MAX_CPU_SECONDS: float = 3600.0  # CPU time after which a worker process is recycled; 0 disables
+    WORKER_NUM_THREADS: int = 1  # BLAS/OpenMP threads per worker process; 0 keeps the library default
+    WORKER_CPU_AFFINITY: bool = False  # Pin each worker to its own disjoint set of CPUs (Linux only)
+    WORKER_START_METHOD: Optional[str] = "forkserver"  # "fork", "spawn" or "forkserver"; empty for the platform default
+    EXECUTOR_SOCKET: str = ""  # Unix socket path or host:port of the execution service; empty runs workers in-process
+    EXECUTION_NODES: list[str] = []  # Execution services to spread calculations over; takes precedence over the above
+    EXECUTOR_TOKEN: str = ""  # Shared secret clients present to execution services; required over TCP
+    EXECUTION_NODE_HEALTH_INTERVAL_SECONDS: float = 5.0  # Interval of health checks of EXECUTION_NODES
     BACKEND_CORS_ORIGINS: str = "http://localhost:5173,http://localhost:3000"
     USERNAME_REGEX: str = r"^[a-zA-Z0-9_ ]+$"
     USERNAME_DESCRIPTION: str = "Use alphanumeric characters, underscores, and spaces."
@@ -24,9 +43,24 @@ class Settings(BaseSettings):
             return r"^[a-zA-Z0-9_ ]+$"
         return v
 
+    @field_validator("WORKER_START_METHOD", mode="before")
+    @classmethod
+    def default_start_method_if_empty(cls, v: Optional[str]) -> Optional[str]:
+        return v or None
+
     # Execution Environment
     EXTRA_ALLOWED_MODULES: set[str] = {"scipy"}
     EXTRA_PRELOAD_MODULES: set[str] = set()
+    WORKER_PRELOAD_SUBMODULES: set[str] = {"scipy.optimize"}  # Imported up front but not injected as globals
+    WORKER_CODE_CACHE_SIZE: int = 256  # Compiled sheet class blocks kept per worker
+    BYTECODE_CACHE_DIR: str = "bytecode_cache"  # Compiled classes of sheet versions persisted here; empty disables
+    PREPARED_SHEET_CACHE_SIZE: int = 32  # Prepared sheets kept per worker (and per pool for re-preparing)
+    SHARED_MEMORY_THRESHOLD_BYTES: int = 1048576  # Arrays at least this large bypass pickling; 0 disables
+    WORKER_STDOUT_LIMIT_BYTES: int = 65536  # Printed output kept per node and returned with its result; 0 discards it
+    WORKER_NODE_MEMO_MB: int = 0  # Memory per worker for reusing results of pure function nodes; 0 disables
+    SWEEP_CHUNK_SIZE: int = 50  # Sweep steps per batch job; interactive work can run between chunks
+    TRUSTED_SHEET_VERSIONS: set[str] = set()  # Admin-approved sheet version ids run without RestrictedPython guards
+    TRUSTED_WORKER_COUNT: int = 1  # Workers of the separate pool that runs them; 0 keeps them restricted
 
     # AI Config
     DEFAULT_AI_PROVIDER: str = "gemini"
@@ -11,3 +11,19 @@ class GraphExecutionError(Exception):
 
 class ValueRangeValidationError(GraphExecutionError):
     pass
+
+
+class ExecutionOverloadedError(Exception):
+    """Raised when the worker pool rejects a calculation because its queue is full."""
+
+    def __init__(self, message: str, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+class ExecutorUnavailableError(Exception):
+    """Raised when the shared execution service cannot be reached."""
+
+
+class UnknownHandleError(KeyError):
+    """Raised when a prepared sheet handle is unknown, e.g. because the pool evicted it."""
@@ -1,18 +1,53 @@
 import asyncio
-import io
+import builtins
+import gc
+import hashlib
+import importlib
+import importlib.metadata
+import importlib.util
 import linecache
+import logging
+import marshal
 import multiprocessing
-import queue as pyqueue
+import os
+import pickle
+import re
+import resource
+import struct
 import sys
+import tempfile
 import threading
+import time
 import traceback
-import uuid
-from typing import Any, Dict, Optional
+import tracemalloc
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
+import numpy as np
 from parascope_runtime import (
     GraphStructureError,
     NodeError,
     NodeExecutionError,
+    NodeMemo,
+    NodeProfiler,
+    OutputCapture,
     ParascopeError,
     SheetBase,
     ValueValidationError,
@@ -35,6 +70,8 @@ from RestrictedPython.Guards import (
 )
 
 from .config import settings
+from .exceptions import ExecutionOverloadedError, ExecutorUnavailableError, UnknownHandleError
+from .metrics import observe_timings, render_samples, timed
 
 SYSTEM_ALLOWED_MODULES = {
     # Runtime Requirements & Stdlib Utilities
@@ -55,18 +92,432 @@ SYSTEM_ALLOWED_MODULES = {
 
 SYSTEM_PRELOAD_MODULES = SYSTEM_ALLOWED_MODULES.copy()
 
+logger = logging.getLogger(__name__)
+
+
+# Generated scripts end with an unindented "# --- ... Entry Point ---" comment.
+# Everything above it is class definitions, which only change when the sheet does.
+ENTRY_POINT_PATTERN = re.compile(r"^# --- .*Entry Point ---$", re.MULTILINE)
+ENTRY_FILENAME = "<parascope-entry>"
+# Every generated sheet class starts with an unindented @sheet(...) decorator; node code is always indented
+SHEET_BLOCK_PATTERN = re.compile(r"^@sheet\(", re.MULTILINE)
+# Written by the generator for classes of immutable sheet versions
+VERSIONED_BLOCK_PATTERN = re.compile(r"^@sheet\('[^']*'\)  # version ([0-9a-fA-F-]+) generator (\d+)$", re.MULTILINE)
+
+
+# Result projections: which node results the worker copies and sends back.
+# Besides these two, a projection can be a collection of node ids, at any nesting depth.
+FULL_STATE = "full"  # Every node of the root sheet and of every nested sheet
+OUTPUTS_ONLY = "outputs"  # Output nodes of the root sheet
+Projection = Union[str, Iterable[str]]
+
+
+def _projection_task_value(projection: Projection) -> Any:
+    """Encodes a projection for the worker: None for the full state, the mode, or a set of node ids."""
+    if isinstance(projection, str):
+        if projection == FULL_STATE:
+            return None
+        if projection == OUTPUTS_ONLY:
+            return OUTPUTS_ONLY
+        raise ValueError(f"Unknown result projection: {projection}")
+    return frozenset(str(node_id) for node_id in projection)
+
+
+def _output_node_ids(instance: SheetBase) -> Set[str]:
+    node_ids = set()
+    for name in dir(type(instance)):
+        config = getattr(getattr(type(instance), name, None), "_node_config", None)
+        if isinstance(config, dict) and config.get("type") == "output":
+            node_ids.add(config["id"])
+    return node_ids
+
+
+def _extract_state(instance: SheetBase, node_ids: Optional[FrozenSet[str]]) -> Dict[str, Any]:
+    """Copies the results of `instance` and its nested sheets, limited to `node_ids` unless it is None."""
+    state = {}
+    for nid, res_obj in instance.results.items():
+        nested = _extract_state(instance.node_instances[nid], node_ids) if nid in instance.node_instances else None
+        if node_ids is None or nid in node_ids:
+            state[nid] = res_obj.copy()
+            if nested is not None:
+                state[nid]["nodes"] = nested
+        elif nested:
+            # Keeps the path to selected nodes inside the nested sheet, without this node's own result
+            state[nid] = {"nodes": nested}
+    return state
+
 
 class ExecutionResult(BaseModel):
     result: Optional[Any] = None
     stdout: str = ""
     error: Optional[str] = None
     success: bool = False
+    timings: Dict[str, float] = {}  # Seconds spent per phase, e.g. "queue_wait", "compile", "exec"
+
+
+def split_script(script: str) -> Tuple[str, str]:
+    """
+    Splits a generated script into its definitions and its entry point.
+    The entry point is padded with blank lines so line numbers match the original script.
+    """
+    matches = list(ENTRY_POINT_PATTERN.finditer(script))
+    if not matches:
+        return script, ""
+
+    match = matches[-1]
+    definitions = script[: match.start()]
+    padding = "\n" * definitions.count("\n")
+    return definitions, padding + script[match.start() :]
+
+
+def split_blocks(definitions: str) -> List[str]:
+    """
+    Splits generated definitions into the header and one block per sheet class.
+    A class block only depends on its own sheet, so it is the same in every script that embeds the sheet.
+    """
+    starts = [m.start() for m in SHEET_BLOCK_PATTERN.finditer(definitions)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    # Trailing blank lines depend on the block's position in the script
+    ends = starts[1:] + [len(definitions)]
+    return [definitions[start:end].rstrip() + "\n" for start, end in zip(starts, ends, strict=True)]
+
+
+def _bytecode_environment() -> str:
+    """Identifies the interpreter and compiler; bytecode is only valid for the environment that produced it."""
+    try:
+        restricted_version = importlib.metadata.version("RestrictedPython")
+    except importlib.metadata.PackageNotFoundError:
+        restricted_version = "unknown"
+    return f"{sys.implementation.cache_tag}-restrictedpython-{restricted_version}"
+
+
+class CodeCache:
+    """
+    Bounded LRU of compiled RestrictedPython code objects, keyed by a content hash of the source.
+    With a directory, blocks of version-pinned sheets are also persisted as marshalled code, so they
+    survive worker restarts and deploys. Blocks of trusted versions are compiled with plain compile()
+    and run with the full builtins.
+    """
+
+    def __init__(self, max_size: int, directory: Optional[str] = None, trusted_versions: FrozenSet[str] = frozenset()):
+        self.max_size = max(1, max_size)
+        self.trusted_versions = trusted_versions
+        self.entries: OrderedDict[str, Any] = OrderedDict()
+        # Filenames of cached code compiled without guards
+        self.trusted_filenames: Set[str] = set()
+        # Prepared sheets keep running code that may have left the cache: handle -> filenames,
+        # and how many handles hold each filename, so its source stays in linecache for tracebacks
+        self.retained: Dict[str, List[str]] = {}
+        self.references: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.directory = os.path.join(directory, _bytecode_environment()) if directory else None
+
+    @staticmethod
+    def _filename(key: str) -> str:
+        return f"<parascope-{key[:12]}>"
+
+    def get_or_compile(self, source: str) -> Any:
+        key = hashlib.sha256(source.encode()).hexdigest()
+        code_obj = self.entries.get(key)
+        if code_obj is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return code_obj
+
+        self.misses += 1
+        filename = self._filename(key)
+        # Register source in linecache so traceback can show source lines.
+        # The entry lives as long as the compiled code does.
+        linecache.cache[filename] = (len(source), None, [line + "\n" for line in source.splitlines()], filename)
+        match = VERSIONED_BLOCK_PATTERN.match(source)
+        trusted = match is not None and match.group(1) in self.trusted_versions
+        path = self._persistent_path(match, key, trusted) if match else None
+        code_obj = self._load(path) if path else None
+        if code_obj is None:
+            try:
+                # Admin-approved versions skip the guards RestrictedPython puts around every
+                # attribute access, subscript, iteration and augmented assignment
+                code_obj = (compile if trusted else compile_restricted)(source, filename, "exec")
+            except Exception:
+                linecache.cache.pop(filename, None)
+                raise
+            if path:
+                self._store(path, code_obj)
+
+        self.entries[key] = code_obj
+        if trusted:
+            self.trusted_filenames.add(filename)
+        while len(self.entries) > self.max_size:
+            evicted = self._filename(self.entries.popitem(last=False)[0])
+            if evicted not in self.references:
+                linecache.cache.pop(evicted, None)
+            self.trusted_filenames.discard(evicted)
+        return code_obj
+
+    def retain(self, handle: str, code_objs: Iterable[Any]):
+        """Keeps the source of code a prepared sheet runs in linecache until the handle is released."""
+        self.release(handle)
+        filenames = [code_obj.co_filename for code_obj in code_objs]
+        self.retained[handle] = filenames
+        for filename in filenames:
+            self.references[filename] = self.references.get(filename, 0) + 1
+
+    def release(self, handle: str):
+        filenames = self.retained.pop(handle, [])
+        cached = {self._filename(key) for key in self.entries} if filenames else set()
+        for filename in filenames:
+            self.references[filename] -= 1
+            if self.references[filename] == 0:
+                del self.references[filename]
+                if filename not in cached:
+                    linecache.cache.pop(filename, None)
+
+    def is_trusted(self, code_obj: Any) -> bool:
+        """Whether the code was compiled without guards and runs with the full builtins."""
+        return code_obj.co_filename in self.trusted_filenames
+
+    def _persistent_path(self, match: re.Match, key: str, trusted: bool) -> Optional[str]:
+        if not self.directory:
+            return None
+        version_id, generator_version = match.groups()
+        # Unguarded code lives apart, so a restricted worker never loads it
+        directory = os.path.join(self.directory, "trusted") if trusted else self.directory
+        # The content hash guards against two generated blocks sharing a version (e.g. renamed classes)
+        return os.path.join(directory, f"{version_id}-g{generator_version}-{key[:16]}.bin")
+
+    def _load(self, path: str) -> Any:
+        try:
+            with open(path, "rb") as f:
+                code_obj = marshal.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError, TypeError):
+            logger.warning("Ignoring unreadable bytecode cache file %s", path)
+            return None
+        self.disk_hits += 1
+        return code_obj
+
+    def _store(self, path: str, code_obj: Any):
+        # Several workers may compile the same block; write to a temporary file and rename atomically
+        try:
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    marshal.dump(code_obj, f)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            logger.warning("Could not write bytecode cache file %s: %s", path, e)
+
+    def get_or_compile_blocks(self, definitions: str) -> List[Any]:
+        """Compiles definitions block by block, so sheet classes shared between scripts are compiled once."""
+        return [self.get_or_compile(block) for block in split_blocks(definitions)]
+
+    def stats(self) -> Dict[str, int]:
+        stats = {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+        if self.directory:
+            stats["disk_hits"] = self.disk_hits
+        return stats
+
+
+class _PrintCollector:
+    """
+    Target of print() in RestrictedPython code, which calls `_print_(_getattr_)` and then
+    `_call_print(...)`. Writes go to sys.stdout, which the worker points at the task's output capture.
+    """
+
+    def __init__(self, _getattr_=None):
+        self._getattr_ = _getattr_
+
+    def _call_print(self, *objects, **kwargs):
+        if kwargs.get("file") is None:
+            kwargs["file"] = sys.stdout
+        else:
+            self._getattr_(kwargs["file"], "write")
+        print(*objects, **kwargs)
+
+    def __call__(self) -> str:
+        # The `printed` variable: what the current node has printed so far
+        return sys.stdout.getvalue() if isinstance(sys.stdout, OutputCapture) else ""
+
+
+class SharedArray:
+    """Sent in place of a large ndarray; the array data travels through a shared memory segment."""
+
+    __slots__ = ("name", "shape", "dtype")
+
+    def __init__(self, name: str, shape: Tuple[int, ...], dtype: np.dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+    def __getstate__(self):
+        return (self.name, self.shape, self.dtype)
+
+    def __setstate__(self, state):
+        self.name, self.shape, self.dtype = state
+
+
+def _export_shared_arrays(value: Any, threshold: int, names: List[str]) -> Any:
+    """
+    Returns a copy of `value` with large ndarrays moved into shared memory segments.
+    Only SharedArray descriptors are pickled; the parent maps and later unlinks the segments.
+    """
+    if isinstance(value, dict):
+        return {k: _export_shared_arrays(v, threshold, names) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_export_shared_arrays(v, threshold, names) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_export_shared_arrays(v, threshold, names) for v in value)
+    if type(value) is np.ndarray and not value.dtype.hasobject and value.nbytes >= threshold > 0:
+        segment = SharedMemory(create=True, size=value.nbytes)
+        names.append(segment.name)
+        target = np.ndarray(value.shape, dtype=value.dtype, buffer=segment.buf)
+        target[...] = value
+        del target  # The mapping cannot be closed while a view exports it
+        segment.close()
+        return SharedArray(segment.name, value.shape, value.dtype)
+    return value
+
+
+def _unlink_segments(names: List[str]):
+    for name in names:
+        try:
+            segment = SharedMemory(name=name)
+        except FileNotFoundError:
+            continue
+        segment.close()
+        segment.unlink()
+
+
+def _import_shared_arrays(value: Any, segments: List[SharedMemory]) -> Any:
+    """Replaces SharedArray descriptors with ndarray views onto their (now attached) segments."""
+    if isinstance(value, dict):
+        return {k: _import_shared_arrays(v, segments) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_import_shared_arrays(v, segments) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_import_shared_arrays(v, segments) for v in value)
+    if isinstance(value, SharedArray):
+        segment = SharedMemory(name=value.name)
+        # The mapping stays valid after unlinking; nothing is left behind if the result is never released
+        segment.unlink()
+        segments.append(segment)
+        return np.ndarray(value.shape, dtype=value.dtype, buffer=segment.buf)
+    return value
+
+
+# Mappings that were still referenced when their result was released
+_pending_segments: List[SharedMemory] = []
+
+
+def _close_segments(segments: List[SharedMemory]) -> List[SharedMemory]:
+    in_use = []
+    for segment in segments:
+        try:
+            segment.close()
+        except BufferError:
+            in_use.append(segment)
+    return in_use
+
+
+def release_result(result: Dict[str, Any]):
+    """
+    Unmaps the shared memory behind large arrays in an execution result.
+    Call it once the results have been serialized; the arrays must not be used afterwards.
+    """
+    global _pending_segments
+    segments = result.pop("shared_memory", None)
+    if segments:
+        # Drop our references to the views so the mappings can be closed
+        result.pop("results", None)
+        segments = _close_segments(segments)
+    # Views still held elsewhere (e.g. by a caller's local variables) are retried on the next release
+    _pending_segments = _close_segments(_pending_segments) + (segments or [])
+
+
+def preload_libraries(extra_preload_modules: Set[str], preload_submodules: Set[str]) -> Dict[str, Any]:
+    """
+    Imports the libraries every sandbox starts with and returns them by name.
+    Submodules (e.g. "scipy.optimize") are imported so later imports are free, but are not injected as globals.
+    """
+    preloaded_libs = {}
+    for mod_name in SYSTEM_PRELOAD_MODULES.union(extra_preload_modules):
+        try:
+            preloaded_libs[mod_name] = __import__(mod_name)
+        except ImportError:
+            # If a configured module is missing, we just ignore it (or could log it)
+            pass
+    for mod_name in preload_submodules:
+        try:
+            importlib.import_module(mod_name)
+        except ImportError:
+            pass
+    return preloaded_libs
+
+
+def _resident_memory() -> int:
+    """Resident set size of the current process in bytes (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+# Read by the numeric libraries when they are first imported
+THREAD_LIMIT_VARIABLES = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+
+@contextmanager
+def _worker_environment(num_threads: int) -> Iterator[None]:
+    """
+    Caps BLAS/OpenMP threads in processes started inside the block, so workers do not
+    oversubscribe the CPU. Covers "spawn" workers and the forkserver, which import numpy
+    themselves; "fork" workers inherit the parent's already initialized libraries.
+    """
+    if num_threads <= 0:
+        yield
+        return
+    previous = {name: os.environ.get(name) for name in THREAD_LIMIT_VARIABLES}
+    os.environ.update({name: str(num_threads) for name in THREAD_LIMIT_VARIABLES})
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _cpu_groups(count: int) -> List[Set[int]]:
+    """Splits the CPUs available to this process into up to `count` disjoint sets."""
+    cpus = sorted(os.sched_getaffinity(0))
+    groups = min(max(1, count), len(cpus))
+    size = len(cpus) // groups
+    return [set(cpus[i * size : (i + 1) * size]) for i in range(groups)]
 
 
 # --- Persistent Worker Pool Implementation ---
 
 
-def _persistent_worker_loop(task_queue, result_queue, runtime_classes, config_values):
+def _persistent_worker_loop(task_conn, result_conn, runtime_classes, config_values):
     """
     Long-running worker loop.
     Pre-imports heavy libraries to save time on subsequent runs.
@@ -87,16 +538,22 @@ def _persistent_worker_loop(task_queue, result_queue, runtime_classes, config_va
     ) = runtime_classes
 
     allowed_modules = SYSTEM_ALLOWED_MODULES.union(config_values.get("extra_allowed_modules", set()))
-    preload_modules = SYSTEM_PRELOAD_MODULES.union(config_values.get("extra_preload_modules", set()))
 
-    # Pre-import common scientific libraries
-    preloaded_libs = {}
-    for mod_name in preload_modules:
+    num_threads = config_values.get("num_threads", 0)
+    if num_threads > 0:
+        # Also caps libraries that were already initialized (e.g. when forked from the parent)
         try:
-            preloaded_libs[mod_name] = __import__(mod_name)
+            from threadpoolctl import threadpool_limits
         except ImportError:
-            # If a configured module is missing, we just ignore it (or could log it)
             pass
+        else:
+            threadpool_limits(num_threads)
+
+    # Pre-import common scientific libraries (already imported when forked from the template process)
+    preloaded_libs = preload_libraries(
+        config_values.get("extra_preload_modules", set()),
+        config_values.get("preload_submodules", set()),
+    )
 
     # Setup RestrictedPython environment
 
@@ -135,117 +592,202 @@ def _persistent_worker_loop(task_queue, result_queue, runtime_classes, config_va
 
     _safe_builtins["__import__"] = safe_import
 
+    def _write_(obj):
+        return obj
+
+    def _inplacevar_(op, target, expr):
+        if op == "+=":
+            target += expr
+        elif op == "-=":
+            target -= expr
+        elif op == "*=":
+            target *= expr
+        elif op == "/=":
+            target /= expr
+        elif op == "//=":
+            target //= expr
+        elif op == "%=":
+            target %= expr
+        elif op == "**=":
+            target **= expr
+        elif op == "<<=":
+            target <<= expr
+        elif op == ">>=":
+            target >>= expr
+        elif op == "&=":
+            target &= expr
+        elif op == "^=":
+            target ^= expr
+        elif op == "|=":
+            target |= expr
+        return target
+
+    # Trusted blocks are compiled with plain compile(), so they call print() rather than _print_
+    # and expect the builtins RestrictedPython leaves out
+    trusted_builtins = dict(builtins.__dict__)
+
+    # Construct safe globals
+    # We explicitly allow the runtime classes and pre-imported libs
+    base_globals = safe_globals.copy()
+    base_globals.update(
+        {
+            "__builtins__": _safe_builtins,
+            "__metaclass__": type,  # Required for RestrictedPython in some modes
+            "__name__": "__restricted_main__",
+            "_write_": _write_,
+            "_print_": _PrintCollector,
+            "_inplacevar_": _inplacevar_,
+            "_getattr_": safer_getattr,
+            "_getitem_": default_guarded_getitem,
+            "_getiter_": default_guarded_getiter,
+            "_iter_unpack_sequence_": guarded_iter_unpack_sequence,
+            "_unpack_sequence_": guarded_unpack_sequence,
+            # Runtime Classes
+            "SheetBase": SheetBase,
+            "NodeError": NodeError,
+            "ParascopeError": ParascopeError,
+            "NodeExecutionError": NodeExecutionError,
+            "GraphStructureError": GraphStructureError,
+            "ValueValidationError": ValueValidationError,
+            "node": node,
+            "sheet": sheet,
+            "function_node": function_node,
+            "constant_node": constant_node,
+            "input_node": input_node,
+            "output_node": output_node,
+            "sheet_node": sheet_node,
+            "lut_node": lut_node,
+        }
+    )
+    # Pre-injected Libraries
+    base_globals.update(preloaded_libs)
+
+    def extract_full_state(global_vars, projection=None):
+        """Helper to extract recursive state from sheet_instance if it exists, limited to the projection"""
+        root_sheet = global_vars.get("sheet_instance")
+        if root_sheet and isinstance(root_sheet, SheetBase):
+            if projection == OUTPUTS_ONLY:
+                output_ids = _output_node_ids(root_sheet)
+                return {nid: res.copy() for nid, res in root_sheet.results.items() if nid in output_ids}
+            return _extract_state(root_sheet, projection)
+        return global_vars.get("results", {})
+
+    code_cache = CodeCache(
+        config_values.get("code_cache_size", 128),
+        config_values.get("bytecode_cache_dir"),
+        config_values.get("trusted_versions", frozenset()),
+    )
+
+    def exec_block(block_code, namespace):
+        if not code_cache.is_trusted(block_code):
+            exec(block_code, namespace)
+            return
+        # Functions keep the builtins their globals had when they were defined,
+        # so methods of trusted classes hold on to the full builtins after they are restored
+        namespace["__builtins__"] = trusted_builtins
+        try:
+            exec(block_code, namespace)
+        finally:
+            namespace["__builtins__"] = _safe_builtins
+
+    # Prepared sheets: handle -> (globals with class definitions loaded, compiled entry point, names they define)
+    prepared: OrderedDict[str, Tuple[Dict[str, Any], Any, Set[str]]] = OrderedDict()
+    prepared_cache_size = max(1, config_values.get("prepared_cache_size", 32))
+    shared_memory_threshold = config_values.get("shared_memory_threshold", 0)
+    stdout_limit = config_values.get("stdout_limit", 0)
+    node_memo_bytes = config_values.get("node_memo_bytes", 0)
+    # Results of pure function nodes, shared by every sheet this worker runs
+    node_memo = NodeMemo(node_memo_bytes) if node_memo_bytes > 0 else None
+    SheetBase._node_memo = node_memo
+
+    # Everything set up so far lives as long as the worker; keep it out of GC scans
+    # so collections stay cheap and forked pages are not dirtied by refcount bookkeeping
+    gc.freeze()
+
+    # Tell the parent that preloading finished and the worker is warm
+    try:
+        result_conn.send({"ready": True})
+    except BrokenPipeError:
+        # The pool shut down while this worker was still starting
+        return
+
     while True:
         try:
-            script = task_queue.get()
-            if script is None:  # Sentinel to exit
-                break
+            task = task_conn.recv()
+        except EOFError:
+            # The parent closed its end of the pipe
+            break
+        if task is None:  # Sentinel to exit
+            break
 
-            results = {}
-            # Register script in linecache so traceback can show source lines
-            # We use a unique name per execution to avoid cache issues
-            filename = f"<parascope-{uuid.uuid4().hex[:8]}>"
-            linecache.cache[filename] = (len(script), None, [line + "\n" for line in script.splitlines()], filename)
-
-            # Capture stdout
-            redirected_output = io.StringIO()
-            sys.stdout = redirected_output
-
-            # Helper for print
-            def _print_(*args, out=redirected_output):
-                return print(*args, file=out)
-
-            def _write_(obj):
-                return obj
-
-            def _inplacevar_(op, target, expr):
-                if op == "+=":
-                    target += expr
-                elif op == "-=":
-                    target -= expr
-                elif op == "*=":
-                    target *= expr
-                elif op == "/=":
-                    target /= expr
-                elif op == "//=":
-                    target //= expr
-                elif op == "%=":
-                    target %= expr
-                elif op == "**=":
-                    target **= expr
-                elif op == "<<=":
-                    target <<= expr
-                elif op == ">>=":
-                    target >>= expr
-                elif op == "&=":
-                    target &= expr
-                elif op == "^=":
-                    target ^= expr
-                elif op == "|=":
-                    target |= expr
-                return target
-
-            # Construct safe globals
-            # We explicitly allow the runtime classes and pre-imported libs
-            global_vars = safe_globals.copy()
-            global_vars.update(
-                {
-                    "__builtins__": _safe_builtins,
-                    "__metaclass__": type,  # Required for RestrictedPython in some modes
-                    "__name__": "__restricted_main__",
-                    "_print_": _print_,
-                    "_write_": _write_,
-                    "_inplacevar_": _inplacevar_,
-                    "_getattr_": safer_getattr,
-                    "_getitem_": default_guarded_getitem,
-                    "_getiter_": default_guarded_getiter,
-                    "_iter_unpack_sequence_": guarded_iter_unpack_sequence,
-                    "_unpack_sequence_": guarded_unpack_sequence,
-                    # Runtime Classes
-                    "SheetBase": SheetBase,
-                    "NodeError": NodeError,
-                    "ParascopeError": ParascopeError,
-                    "NodeExecutionError": NodeExecutionError,
-                    "GraphStructureError": GraphStructureError,
-                    "ValueValidationError": ValueValidationError,
-                    "node": node,
-                    "sheet": sheet,
-                    "function_node": function_node,
-                    "constant_node": constant_node,
-                    "input_node": input_node,
-                    "output_node": output_node,
-                    "sheet_node": sheet_node,
-                    "lut_node": lut_node,
-                }
-            )
-            # Pre-injected Libraries
-            global_vars.update(preloaded_libs)
+        started = time.perf_counter()
+        # Seconds per phase; the parent adds queue wait, transfer and deserialization
+        timings: Dict[str, float] = {}
+        try:
+            # Printed output is captured per node and bounded, so a print in a loop cannot exhaust memory
+            output_capture = OutputCapture(stdout_limit)
+            sys.stdout = output_capture
+            if stdout_limit > 0:
+                SheetBase.output_capture = output_capture
+            if task.get("profile"):
+                # Tracing allocations slows execution down, so it only runs for profiled tasks
+                SheetBase.profiler = NodeProfiler()
+                tracemalloc.start()
 
             success = False
             error = None
             results = {}
+            global_vars = None
 
-            def extract_full_state(global_vars):
-                """Helper to extract recursive state from sheet_instance if it exists"""
-                root_sheet = global_vars.get("sheet_instance")
-                if root_sheet and isinstance(root_sheet, SheetBase):
-
-                    def traverse(instance: SheetBase):
-                        state = {}
-                        for nid, res_obj in instance.results.items():
-                            state[nid] = res_obj.copy()
-                            if nid in instance.node_instances:
-                                sub_instance = instance.node_instances[nid]
-                                state[nid]["nodes"] = traverse(sub_instance)
-                        return state
+            try:
+                handle = task.get("handle")
+                if handle is None:
+                    # One-shot script.
+                    # Class definitions are served from the cache; only the entry point,
+                    # which embeds the input overrides, is compiled on every run.
+                    script = task["script"]
+                    global_vars = base_globals.copy()
+                    with timed(timings, "compile"):
+                        definitions, entry_point = split_script(script)
+                        definitions_code = code_cache.get_or_compile_blocks(definitions)
+                    with timed(timings, "exec"):
+                        for block_code in definitions_code:
+                            exec_block(block_code, global_vars)
+                    if entry_point:
+                        linecache.cache[ENTRY_FILENAME] = (
+                            len(script),
+                            None,
+                            [line + "\n" for line in script.splitlines()],
+                            ENTRY_FILENAME,
+                        )
+                        with timed(timings, "compile"):
+                            entry_code = compile_restricted(entry_point, ENTRY_FILENAME, "exec")
+                        with timed(timings, "exec"):
+                            exec(entry_code, global_vars)
+                else:
+                    # Prepared sheet: definitions are executed once, later runs only inject overrides
+                    if "definitions" in task:
+                        namespace = base_globals.copy()
+                        with timed(timings, "compile"):
+                            definitions_code = code_cache.get_or_compile_blocks(task["definitions"])
+                            entry_code = code_cache.get_or_compile(task["entry_point"])
+                        with timed(timings, "exec"):
+                            for block_code in definitions_code:
+                                exec_block(block_code, namespace)
+                        prepared[handle] = (namespace, entry_code, set(namespace))
+                        code_cache.retain(handle, [*definitions_code, entry_code])
+                        while len(prepared) > prepared_cache_size:
+                            code_cache.release(prepared.popitem(last=False)[0])
 
-                    return traverse(root_sheet)
-                return global_vars.get("results", {})
+                    if handle not in prepared:
+                        result_conn.send({"success": False, "error": "Sheet is not prepared", "unprepared": True})
+                        continue
 
-            try:
-                # Compile and execute the script using RestrictedPython
-                code_obj = compile_restricted(script, filename, "exec")
-                exec(code_obj, global_vars)
+                    prepared.move_to_end(handle)
+                    global_vars, entry_code, defined_names = prepared[handle]
+                    global_vars["input_overrides"] = task.get("overrides", {})
+                    with timed(timings, "exec"):
+                        exec(entry_code, global_vars)
                 success = True
             except Exception as e:
                 # If it's a SyntaxError from our generator, don't show global toast
@@ -256,111 +798,918 @@ def _persistent_worker_loop(task_queue, result_queue, runtime_classes, config_va
                     error = traceback.format_exc()
                     success = False
 
-            results = extract_full_state(global_vars)
-            result_queue.put({"success": success, "error": error, "results": results})
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+            if global_vars is not None:
+                with timed(timings, "extract"):
+                    results = extract_full_state(global_vars, task.get("projection"))
+                if handle is not None:
+                    # Prepared namespaces outlive the run; drop per-run state so it is neither leaked nor reused
+                    for name in set(global_vars) - defined_names:
+                        del global_vars[name]
+
+            # Large arrays go through shared memory instead of being pickled through the pipe
+            shared_names: List[str] = []
+            with timed(timings, "shared_memory"):
+                results = _export_shared_arrays(results, shared_memory_threshold, shared_names)
+            if not shared_names:
+                timings.pop("shared_memory")
+            timings["worker"] = time.perf_counter() - started
+            reply = {
+                "success": success,
+                "error": error,
+                "results": results,
+                "timings": timings,
+                "code_cache": code_cache.stats(),
+                "usage": {"rss": _resident_memory(), "cpu": time.process_time()},
+            }
+            if shared_names:
+                reply["shared_arrays"] = len(shared_names)
+            if node_memo is not None:
+                reply["node_memo"] = node_memo.stats()
+            # Printed outside of any node, e.g. while defining classes
+            script_output = output_capture.take(None) if stdout_limit > 0 else None
+            if script_output:
+                reply["stdout"] = script_output
+            try:
+                result_conn.send(reply)
+            except Exception:
+                # The parent never learns about these segments
+                _unlink_segments(shared_names)
+                raise
 
         except Exception as e:
-            # Critical failure in the loop (e.g. queue error)
+            # Critical failure in the loop (e.g. unpicklable result)
             try:
-                result_queue.put({"success": False, "error": f"Worker internal error: {e}"})
+                result_conn.send({"success": False, "error": f"Worker internal error: {e}"})
             except Exception:
                 pass
+        finally:
+            # Nothing printed or measured during this task carries over to the next one
+            sys.stdout = sys.__stdout__
+            SheetBase.output_capture = None
+            SheetBase.profiler = None
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+
+def _take_frame(buffer: bytearray) -> Optional[bytes]:
+    """
+    Pops one complete message from the buffer, if there is one.
+    Uses the same length-prefixed framing as multiprocessing.connection.Connection.
+    """
+    if len(buffer) < 4:
+        return None
+    (size,) = struct.unpack("!i", buffer[:4])
+    header = 4
+    if size == -1:
+        if len(buffer) < 12:
+            return None
+        (size,) = struct.unpack("!Q", buffer[4:12])
+        header = 12
+    if len(buffer) < header + size:
+        return None
+    frame = bytes(buffer[header : header + size])
+    del buffer[: header + size]
+    return frame
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _make_frame(payload: bytes) -> bytes:
+    if len(payload) > 0x7FFFFFFF:
+        return struct.pack("!iQ", -1, len(payload)) + payload
+    return struct.pack("!i", len(payload)) + payload
+
+
+WORKER_TEMPLATE_MODULE = f"{__package__}.worker_template"
+
+_mp_context: Optional[multiprocessing.context.BaseContext] = None
+
+
+def _get_mp_context() -> multiprocessing.context.BaseContext:
+    """
+    Returns the multiprocessing context used to start workers.
+    In "forkserver" mode the server process imports the worker template once,
+    and every worker is forked from it with all libraries already loaded.
+    """
+    global _mp_context
+    if _mp_context is None:
+        context = multiprocessing.get_context(settings.WORKER_START_METHOD)
+        if context.get_start_method() == "forkserver":
+            context.set_forkserver_preload([WORKER_TEMPLATE_MODULE])
+        elif (
+            context.get_start_method() == "fork"
+            and settings.WORKER_NUM_THREADS > 0
+            and importlib.util.find_spec("threadpoolctl") is None
+        ):
+            # Forked workers inherit numeric libraries that already read the environment
+            logger.warning("WORKER_NUM_THREADS is not applied to forked workers because threadpoolctl is not installed")
+        _mp_context = context
+    return _mp_context
+
+
+class WorkerProcess:
+    """
+    A single persistent worker process and the parent's ends of its pipes.
+    The worker side uses blocking Connection.recv/send; the parent side reads and
+    writes the same frames through non-blocking file descriptors on the event loop.
+    """
+
+    def __init__(self, trusted_versions: FrozenSet[str] = frozenset()):
+        self.ready = False  # Set once the worker reports that preloading finished
+        self.ready_at = 0.0  # time.monotonic() of that report
+        self.ready_task: Optional[asyncio.Task] = None
+        self._buffer = bytearray()
+        # Event loop a reader is registered with on the result pipe, if any
+        self._reading_loop: Optional[asyncio.AbstractEventLoop] = None
+
+        context = _get_mp_context()
+        task_reader, task_writer = context.Pipe(duplex=False)
+        result_reader, result_writer = context.Pipe(duplex=False)
+        self.process = context.Process(
+            target=_persistent_worker_loop,
+            args=(
+                task_reader,
+                result_writer,
+                (
+                    SheetBase,
+                    NodeError,
+                    ParascopeError,
+                    ValueValidationError,
+                    node,
+                    sheet,
+                    function_node,
+                    constant_node,
+                    input_node,
+                    output_node,
+                    sheet_node,
+                    lut_node,
+                ),
+                {
+                    "extra_allowed_modules": settings.EXTRA_ALLOWED_MODULES,
+                    "extra_preload_modules": settings.EXTRA_PRELOAD_MODULES,
+                    "preload_submodules": settings.WORKER_PRELOAD_SUBMODULES,
+                    "code_cache_size": settings.WORKER_CODE_CACHE_SIZE,
+                    "bytecode_cache_dir": settings.BYTECODE_CACHE_DIR or None,
+                    "prepared_cache_size": settings.PREPARED_SHEET_CACHE_SIZE,
+                    "shared_memory_threshold": settings.SHARED_MEMORY_THRESHOLD_BYTES,
+                    "num_threads": settings.WORKER_NUM_THREADS,
+                    "stdout_limit": settings.WORKER_STDOUT_LIMIT_BYTES,
+                    "node_memo_bytes": settings.WORKER_NODE_MEMO_MB * 1024 * 1024,
+                    "trusted_versions": trusted_versions,
+                },
+            ),
+            daemon=True,
+        )
+        with _worker_environment(settings.WORKER_NUM_THREADS):
+            self.process.start()
+
+        # The worker owns its ends now; closing ours lets a crash surface as EOF
+        task_reader.close()
+        result_writer.close()
+        os.set_blocking(task_writer.fileno(), False)
+        os.set_blocking(result_reader.fileno(), False)
+        self.task_conn: Connection = task_writer  # Parent -> worker
+        self.result_conn: Connection = result_reader  # Worker -> parent
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid
+
+    def is_alive(self) -> bool:
+        return not self.task_conn.closed and self.process.is_alive()
+
+    def cancel_ready_task(self):
+        if self.ready_task is not None and not self.ready_task.done():
+            self.ready_task.cancel()
+        self.ready_task = None
+
+    def _stop_reading(self):
+        if self._reading_loop is not None:
+            self._reading_loop.remove_reader(self.result_conn.fileno())
+            self._reading_loop = None
+
+    def _close_pipes(self):
+        self.cancel_ready_task()
+        # Now, not when the cancelled reader gets to run: by then a new pipe may have taken over the fd
+        self._stop_reading()
+        self.task_conn.close()
+        self.result_conn.close()
+
+    def kill(self):
+        # Use kill() instead of terminate() to ensure stuck loops (like while True) are stopped immediately.
+        # The exited process is reaped by multiprocessing when the next one starts.
+        self.process.kill()
+        self._close_pipes()
+
+    def stop(self):
+        """Asks an idle worker to exit."""
+        if not self.task_conn.closed:
+            try:
+                self.task_conn.send(None)
+            except OSError:
+                pass
+        self._close_pipes()
+
+    async def send(self, message: Any):
+        loop = asyncio.get_running_loop()
+        fd = self.task_conn.fileno()
+        view = memoryview(_make_frame(pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)))
+        while view:
+            try:
+                view = view[os.write(fd, view) :]
+            except BlockingIOError:
+                writable = loop.create_future()
+                loop.add_writer(fd, _resolve, writable)
+                try:
+                    await writable
+                finally:
+                    loop.remove_writer(fd)
+
+    async def _receive_frame(self) -> bytes:
+        frame = _take_frame(self._buffer)
+        if frame is not None:
+            return frame
+
+        loop = asyncio.get_running_loop()
+        fd = self.result_conn.fileno()
+        received = loop.create_future()
+
+        def _on_readable():
+            if received.done():
+                return
+            try:
+                chunk = os.read(fd, 1 << 20)
+            except BlockingIOError:
+                return
+            except OSError as e:
+                received.set_exception(e)
+                return
+            if not chunk:
+                received.set_exception(EOFError("Worker closed the result pipe"))
+                return
+            self._buffer.extend(chunk)
+            complete = _take_frame(self._buffer)
+            if complete is not None:
+                received.set_result(complete)
+
+        loop.add_reader(fd, _on_readable)
+        self._reading_loop = loop
+        try:
+            return await received
+        finally:
+            self._stop_reading()
+
+    async def receive(self) -> Any:
+        if self.ready_task is not None:
+            # A spare handed out while still loading: its handshake is read to the end first,
+            # instead of two readers taking turns on the same pipe
+            await asyncio.shield(self.ready_task)
+            self.ready_task = None
+        while True:
+            frame = await self._receive_frame()
+            start = time.perf_counter()
+            message = pickle.loads(frame)
+            if isinstance(message, dict) and message.get("ready"):
+                self.ready = True
+                self.ready_at = time.monotonic()
+                continue
+            if isinstance(message, dict) and "timings" in message:
+                message["timings"]["deserialize"] = time.perf_counter() - start
+            return message
+
+    async def wait_ready(self):
+        """Consumes the worker's start-up handshake."""
+        while not self.ready:
+            message = pickle.loads(await self._receive_frame())
+            if isinstance(message, dict) and message.get("ready"):
+                self.ready = True
+                self.ready_at = time.monotonic()
 
 
 class WorkerHandle:
-    """Manages a single persistent worker process and its queues."""
+    """
+    A slot in the pool that runs one task at a time on a worker process.
+    When its process is killed or crashes, the slot swaps in a replacement
+    from `spawn`, which the pool serves from its warm standby processes.
+    """
 
-    def __init__(self, index: int):
+    def __init__(
+        self, index: int, spawn: Optional[Callable[[], WorkerProcess]] = None, cpus: Optional[Set[int]] = None
+    ):
         self.index = index
-        self.task_queue = multiprocessing.Queue()
-        self.result_queue = multiprocessing.Queue()
-        self.process: Optional[multiprocessing.Process] = None
-        self.lock = threading.Lock()  # Ensures only one thread uses this worker at a time
+        self._spawn = spawn or WorkerProcess
+        self.cpus = cpus  # CPUs every process of this slot is pinned to
+        self.process: Optional[WorkerProcess] = None
+        # Scheduling state, owned by WorkerPool: a worker runs at most one job at a time
+        self.in_flight = False
+        self.lane: Optional[str] = None  # Lane of the job being run
+        self.tasks_completed = 0
+        self.idle_since = time.monotonic()
+        self.startup_wait = 0.0  # Seconds the current job spent waiting for a cold process to start
+        self.code_cache_stats: Dict[str, int] = {}  # Last hit/miss counters reported by the worker
+        self.node_memo_stats: Dict[str, int] = {}  # Same, for the memo of function node results
+        self.prepared_handles: Set[str] = set()  # Prepared sheets loaded in the current process
+        # Prepared runs that found their sheet already loaded, and runs that had to load it
+        self.prepared_hits = 0
+        self.prepared_misses = 0
+        # Usage of the current process, checked against the recycling limits after every task
+        self.process_tasks = 0
+        self.rss_bytes = 0
+        self.cpu_seconds = 0.0
+        self.recycles = 0
         self._ensure_alive()
 
     def _ensure_alive(self):
         if self.process is None or not self.process.is_alive():
-            self.process = multiprocessing.Process(
-                target=_persistent_worker_loop,
-                args=(
-                    self.task_queue,
-                    self.result_queue,
-                    (
-                        SheetBase,
-                        NodeError,
-                        ParascopeError,
-                        ValueValidationError,
-                        node,
-                        sheet,
-                        function_node,
-                        constant_node,
-                        input_node,
-                        output_node,
-                        sheet_node,
-                        lut_node,
-                    ),
-                    {
-                        "extra_allowed_modules": settings.EXTRA_ALLOWED_MODULES,
-                        "extra_preload_modules": settings.EXTRA_PRELOAD_MODULES,
-                    },
-                ),
-                daemon=True,
-            )
-            self.process.start()
+            if self.process is not None:
+                self.process.kill()
+            # A fresh process has none of the previously prepared sheets
+            self.prepared_handles.clear()
+            self.code_cache_stats = {}
+            self.node_memo_stats = {}
+            self.process_tasks = 0
+            self.rss_bytes = 0
+            self.cpu_seconds = 0.0
+            self.process = self._spawn()
+            if self.cpus:
+                try:
+                    os.sched_setaffinity(self.process.pid, self.cpus)
+                except OSError:
+                    # The process may already have exited; the next execute() replaces it
+                    pass
 
-    async def execute(self, script: str, timeout: float) -> Dict[str, Any]:
-        loop = asyncio.get_running_loop()
+    def _recycle_reason(self) -> Optional[str]:
+        if 0 < settings.WORKER_MAX_TASKS <= self.process_tasks:
+            return f"served {self.process_tasks} tasks"
+        if 0 < settings.WORKER_MAX_RSS_MB * 1024 * 1024 <= self.rss_bytes:
+            return f"resident memory {self.rss_bytes / (1024 * 1024):.0f} MB"
+        if 0 < settings.WORKER_MAX_CPU_SECONDS <= self.cpu_seconds:
+            return f"used {self.cpu_seconds:.0f}s of CPU time"
+        return None
 
-        def _blocking_execute():
-            with self.lock:
-                self._ensure_alive()
+    def recycle(self, reason: str):
+        """Retires the idle process and swaps in a fresh one, dropping whatever user code leaked into it."""
+        logger.info("Recycling worker %d (%s)", self.index, reason)
+        self.stop()
+        self.recycles += 1
+        self._ensure_alive()
 
-                # Clear result queue just in case of stale data from a previous crash/timeout
-                while not self.result_queue.empty():
-                    try:
-                        self.result_queue.get_nowait()
-                    except pyqueue.Empty:
-                        break
+    def kill(self):
+        """Hard-kills the worker. The next execute() uses a replacement process."""
+        if self.process is not None:
+            self.process.kill()
+        self.process = None
 
-                try:
-                    self.task_queue.put(script)
-                except Exception:
-                    self.process.terminate()
-                    self._ensure_alive()
-                    self.task_queue.put(script)
+    def replace(self):
+        """Hard-kills the worker and immediately swaps in a replacement."""
+        self.kill()
+        self._ensure_alive()
 
-                try:
-                    result = self.result_queue.get(timeout=timeout)
-                    return result
-                except pyqueue.Empty:
-                    # Timeout: Kill and restart worker
-                    # Use kill() instead of terminate() to ensure stuck loops (like while True) are stopped immediately
-                    if self.process:
-                        self.process.kill()
-                        self.process.join(timeout=1.0)
-                    self.process = None
-                    return {"success": False, "error": "Execution timed out"}
+    def stop(self):
+        """Asks an idle worker to exit."""
+        if self.process is not None:
+            self.process.stop()
+        self.process = None
+
+    async def execute(self, task: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+        self._ensure_alive()
+
+        started = time.perf_counter()
+        sent_at = time.monotonic()
+        try:
+            try:
+                await self.process.send(task)
+            except OSError:
+                # Worker died while idle; replace it and try once more
+                self.replace()
+                await self.process.send(task)
+            result = await asyncio.wait_for(self.process.receive(), timeout)
+        except asyncio.TimeoutError:
+            # Timeout: Kill and swap in a fresh worker
+            self.replace()
+            return {"success": False, "error": "Execution timed out"}
+        except (EOFError, OSError):
+            self.replace()
+            return {"success": False, "error": "Worker process exited unexpectedly"}
+        except asyncio.CancelledError:
+            # The worker is still busy with this task; it cannot be reused
+            self.replace()
+            raise
+
+        # A process that was still starting up answers only after its preload
+        self.startup_wait += max(0.0, self.process.ready_at - sent_at)
+        timings = result.setdefault("timings", {})
+        # Pickling in the worker, the pipe itself and reading the reply off the event loop
+        timings["transfer"] = max(
+            0.0, time.perf_counter() - started - timings.get("worker", 0.0) - timings.get("deserialize", 0.0)
+        )
+        self.code_cache_stats = result.pop("code_cache", self.code_cache_stats)
+        self.node_memo_stats = result.pop("node_memo", self.node_memo_stats)
+        self.process_tasks += 1
+        usage = result.pop("usage", None)
+        if usage:
+            self.rss_bytes = usage["rss"]
+            self.cpu_seconds = usage["cpu"]
+        if result.pop("shared_arrays", 0):
+            segments: List[SharedMemory] = []
+            with timed(timings, "shared_memory"):
+                result["results"] = _import_shared_arrays(result.get("results"), segments)
+            result["shared_memory"] = segments
+
+        # The worker is idle again, so a worn-out process can be swapped without losing work
+        reason = self._recycle_reason()
+        if reason:
+            self.recycle(reason)
+        return result
+
+    async def execute_prepared(
+        self,
+        handle: str,
+        sources: Tuple[str, str],
+        input_overrides: Dict[str, Any],
+        timeout: float,
+        projection: Any = None,
+        profile: bool = False,
+    ) -> Dict[str, Any]:
+        task = {"handle": handle, "overrides": input_overrides, "projection": projection, "profile": profile}
+        if handle in self.prepared_handles:
+            self.prepared_hits += 1
+        else:
+            self.prepared_misses += 1
+            definitions, entry_point = sources
+            task.update({"definitions": definitions, "entry_point": entry_point})
 
-        return await loop.run_in_executor(None, _blocking_execute)
+        result = await self.execute(task, timeout)
+        if result.get("unprepared"):
+            # The worker evicted the sheet from its own cache; load it again
+            definitions, entry_point = sources
+            task.update({"definitions": definitions, "entry_point": entry_point})
+            result = await self.execute(task, timeout)
+
+        if result.get("success"):
+            self.prepared_handles.add(handle)
+        else:
+            self.prepared_handles.discard(handle)
+        result.pop("unprepared", None)
+        return result
+
+
+# Scheduling lanes in priority order. Interactive calculations always go first;
+# batch work (sweeps) is split into chunks so it yields to them between chunks.
+INTERACTIVE = "interactive"
+BATCH = "batch"
+LANES = (INTERACTIVE, BATCH)
+
+
+class _Job:
+    """A unit of work waiting in one of the pool's ready queues."""
+
+    def __init__(
+        self,
+        run: Callable[["WorkerHandle"], Awaitable[Dict[str, Any]]],
+        handle: Optional[str] = None,
+        lane: str = INTERACTIVE,
+        affinity: Optional[str] = None,
+    ):
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane: {lane}")
+        self.run = run
+        self.handle = handle  # Prepared sheet handle, if any, used to prefer workers that hold it
+        self.lane = lane
+        # Jobs with the same key (e.g. a root sheet id) go to the same worker, so its caches stay warm
+        self.affinity = affinity or handle
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+        self.queue_wait = 0.0
+        self.task: Optional[asyncio.Task] = None  # Set once a worker runs the job
+
+
+def prepared_handle(definitions: str, entry_point: str) -> str:
+    return hashlib.sha256(f"{definitions}\0{entry_point}".encode()).hexdigest()
+
+
+def _affinity_rank(key: str, worker: "WorkerHandle") -> int:
+    """
+    Rendezvous hashing: every key ranks the workers by a hash of the pair, so adding or
+    retiring a worker only moves the keys that ranked it first.
+    """
+    digest = hashlib.blake2b(f"{key}\0{worker.index}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def _hit_rate(hits: int, misses: int) -> Optional[float]:
+    total = hits + misses
+    return round(hits / total, 3) if total else None
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
 
 
 class WorkerPool:
-    def __init__(self, count: int):
-        self.workers = [WorkerHandle(i) for i in range(count)]
-        self.current_index = 0
-        self.pool_lock = threading.Lock()
+    """
+    Schedules work onto persistent workers.
+    Requests wait in a ready queue per lane and idle workers take the oldest job of the
+    most urgent lane, so a long run only ever occupies the worker executing it.
+    Batch jobs never take the workers reserved for interactive work.
+    Workers of a pool with `trusted_versions` run those sheet versions without RestrictedPython guards.
+    Queue waits, idle times and service times are read from `clock`, which tests can replace.
+    """
+
+    def __init__(
+        self,
+        count: int,
+        min_count: Optional[int] = None,
+        max_count: Optional[int] = None,
+        trusted_versions: FrozenSet[str] = frozenset(),
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.trusted_versions = trusted_versions
+        self.clock = clock
+        self.standby_swaps = 0
+        # Without explicit bounds the pool has a fixed size
+        self.min_count = max(1, count if min_count is None else min_count)
+        self.max_count = max(self.min_count, count if max_count is None else max_count)
+
+        self.workers: List[WorkerHandle] = []
+        self._next_index = 0
+        self._cpu_groups: Optional[List[Set[int]]] = None
+        # Warm spare processes, swapped into slots whose process was killed or crashed
+        self.standby: List[WorkerProcess] = []
+        for _ in range(min(max(count, self.min_count), self.max_count)):
+            self._add_worker()
+        self._replenish_standby()
+
+        self.queues: Dict[str, Deque[_Job]] = {lane: deque() for lane in LANES}
+        self.running: Set[asyncio.Task] = set()
+        self.queue_waits: Deque[float] = deque(maxlen=1000)  # Recent queue wait samples in seconds
+        # Recent time workers spent on a job, per lane, used to estimate queue waits
+        self.service_times: Dict[str, Deque[float]] = {lane: deque(maxlen=100) for lane in LANES}
+        self.rejected = 0
+        # Jobs with an affinity key that ran on their preferred worker, or overflowed to another one
+        self.affinity_preferred = 0
+        self.affinity_overflow = 0
+        # Prepared sheet sources, kept so a recycled worker can be re-prepared: handle -> (definitions, entry point)
+        self.prepared: OrderedDict[str, Tuple[str, str]] = OrderedDict()
+
+        # Elastic sizing
+        self.scale_ups = 0
+        self.scale_downs = 0
+        self.retired_recycles = 0  # Recycles of workers since reaped, so the total never goes down
+        self.scale_events: Deque[Dict[str, Any]] = deque(maxlen=100)
+        self._scale_up_timer: Optional[asyncio.TimerHandle] = None
+        self._reap_timer: Optional[asyncio.TimerHandle] = None
+
+    def _replenish_standby(self):
+        self.standby = [p for p in self.standby if p.is_alive()]
+        while len(self.standby) < settings.WORKER_STANDBY_COUNT:
+            spare = WorkerProcess(self.trusted_versions)
+            try:
+                spare.ready_task = asyncio.get_running_loop().create_task(spare.wait_ready())
+            except RuntimeError:
+                pass  # No event loop yet; the handshake is consumed on first use instead
+            self.standby.append(spare)
+
+    def _take_standby(self) -> WorkerProcess:
+        """Returns a warm spare (preferring fully preloaded ones) and starts building its replacement."""
+        self.standby = [p for p in self.standby if p.is_alive()]
+        if not self.standby:
+            return WorkerProcess(self.trusted_versions)
+
+        spare = next((p for p in self.standby if p.ready), self.standby[0])
+        self.standby.remove(spare)
+        # A handshake still being read is left to finish; receive() waits for it
+        self.standby_swaps += 1
+        self._replenish_standby()
+        return spare
+
+    def _free_cpus(self) -> Optional[Set[int]]:
+        """The CPU set shared by the fewest workers, when pinning is enabled."""
+        if not settings.WORKER_CPU_AFFINITY or not hasattr(os, "sched_setaffinity"):
+            return None
+        if self._cpu_groups is None:
+            self._cpu_groups = _cpu_groups(self.max_count)
+        return min(self._cpu_groups, key=lambda cpus: sum(1 for w in self.workers if w.cpus == cpus))
+
+    def _add_worker(self) -> WorkerHandle:
+        worker = WorkerHandle(self._next_index, spawn=self._take_standby, cpus=self._free_cpus())
+        worker.idle_since = self.clock()
+        self._next_index += 1
+        self.workers.append(worker)
+        return worker
+
+    def _record_scaling(self, action: str, reason: str):
+        self.scale_events.append({"time": time.time(), "action": action, "size": len(self.workers), "reason": reason})
+        logger.info("Worker pool %s to %d workers (%s)", action.replace("_", " "), len(self.workers), reason)
+
+    @property
+    def pending(self) -> List[_Job]:
+        """Queued jobs in the order they would be dispatched if workers were free."""
+        return [job for lane in LANES for job in self.queues[lane]]
+
+    def _maybe_scale_up(self) -> bool:
+        """
+        Called when every worker is busy. Returns True if a worker was added.
+        Only interactive work grows the pool; batch work makes do with the workers there are.
+        """
+        pending = self.queues[INTERACTIVE]
+        if not pending or len(self.workers) >= self.max_count:
+            return False
+
+        oldest_wait = self.clock() - pending[0].enqueued_at
+        if len(pending) >= settings.WORKER_SCALE_UP_QUEUE_DEPTH:
+            reason = f"queue depth {len(pending)}"
+        elif oldest_wait >= settings.WORKER_SCALE_UP_WAIT_SECONDS:
+            reason = f"queue wait {oldest_wait:.2f}s"
+        else:
+            # Check again once the oldest job has waited long enough
+            if self._scale_up_timer is not None:
+                self._scale_up_timer.cancel()
+            self._scale_up_timer = asyncio.get_running_loop().call_later(
+                settings.WORKER_SCALE_UP_WAIT_SECONDS - oldest_wait, self._dispatch
+            )
+            return False
+
+        self._add_worker()
+        self.scale_ups += 1
+        self._record_scaling("scale_up", reason)
+        return True
+
+    def _schedule_reap(self):
+        # A pending timer is left alone: restarting it whenever a job finishes would
+        # postpone the reap forever under a steady trickle of work
+        if self._reap_timer is not None or len(self.workers) <= self.min_count:
+            return
+        idle = [w.idle_since for w in self.workers if not w.in_flight]
+        if not idle:
+            # The next job to finish schedules it
+            return
+        # Fire when the worker idle the longest has been idle for the whole cooldown
+        delay = max(0.0, min(idle) + settings.WORKER_IDLE_TIMEOUT_SECONDS - self.clock())
+        self._reap_timer = asyncio.get_running_loop().call_later(delay, self._reap_idle_workers)
+
+    def _reap_idle_workers(self):
+        """Retires workers that stayed idle for the whole cooldown, down to the minimum size."""
+        self._reap_timer = None
+        now = self.clock()
+        idle = sorted((w for w in self.workers if not w.in_flight), key=lambda w: w.idle_since)
+        for worker in idle:
+            if len(self.workers) <= self.min_count:
+                break
+            idle_for = now - worker.idle_since
+            if idle_for < settings.WORKER_IDLE_TIMEOUT_SECONDS:
+                break
+            self.workers.remove(worker)
+            worker.stop()
+            self.retired_recycles += worker.recycles
+            self.scale_downs += 1
+            self._record_scaling("scale_down", f"worker {worker.index} idle for {idle_for:.0f}s")
+        self._schedule_reap()
+
+    def _pick_worker(self, job: _Job, idle: List[WorkerHandle]) -> WorkerHandle:
+        if job.affinity is None:
+            # The worker that became idle last, so that workers the load no longer needs
+            # stay idle long enough to be reaped
+            return max(idle, key=lambda w: w.idle_since)
+
+        preferred = max(self.workers, key=lambda w: _affinity_rank(job.affinity, w))
+        worker = None
+        if job.handle is not None:
+            worker = next((w for w in idle if job.handle in w.prepared_handles), None)
+        if worker is None:
+            # When the preferred worker is busy, overflow along the key's ranking, which is just as stable
+            worker = max(idle, key=lambda w: _affinity_rank(job.affinity, w))
+        if worker is preferred:
+            self.affinity_preferred += 1
+        else:
+            self.affinity_overflow += 1
+        return worker
 
-    async def execute(self, script: str, timeout: float = 5.0) -> Dict[str, Any]:
-        # Simple Round-Robin distribution
-        with self.pool_lock:
-            worker = self.workers[self.current_index]
-            self.current_index = (self.current_index + 1) % len(self.workers)
+    def _batch_capacity(self) -> int:
+        # A batch job can always run, even when every worker is reserved
+        return max(1, len(self.workers) - settings.WORKER_INTERACTIVE_RESERVED)
 
-        return await worker.execute(script, timeout)
+    def _next_job(self) -> Optional[_Job]:
+        for lane in LANES:
+            queue = self.queues[lane]
+            while queue and queue[0].future.done():
+                # Cancelled while queued
+                queue.popleft()
+            if not queue:
+                continue
+            if lane == BATCH and sum(1 for w in self.workers if w.lane == BATCH) >= self._batch_capacity():
+                return None
+            return queue.popleft()
+        return None
 
+    def _dispatch(self):
+        while any(self.queues.values()):
+            idle = [w for w in self.workers if not w.in_flight]
+            if not idle:
+                if self._maybe_scale_up():
+                    continue
+                return
 
-# Global Pool Instance
+            job = self._next_job()
+            if job is None:
+                return
+
+            worker = self._pick_worker(job, idle)
+            worker.in_flight = True
+            worker.lane = job.lane
+            job.queue_wait = self.clock() - job.enqueued_at
+            self.queue_waits.append(job.queue_wait)
+
+            job.task = asyncio.ensure_future(self._run(worker, job))
+            self.running.add(job.task)
+            job.task.add_done_callback(self.running.discard)
+
+    async def _run(self, worker: WorkerHandle, job: _Job):
+        started = self.clock()
+        worker.startup_wait = 0.0
+        try:
+            result = await job.run(worker)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            timings = result.setdefault("timings", {})
+            timings["queue_wait"] = job.queue_wait
+            observe_timings(timings)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            # Cold starts are left out, so they do not inflate the estimated waits
+            self.service_times[job.lane].append(self.clock() - started - worker.startup_wait)
+            worker.in_flight = False
+            worker.lane = None
+            worker.tasks_completed += 1
+            worker.idle_since = self.clock()
+            self._dispatch()
+            self._schedule_reap()
+
+    def estimated_wait(self, lane: str = INTERACTIVE) -> float:
+        """
+        Seconds a job added to `lane` now would likely wait for a worker, from recent service times.
+        Workers the pool can still add are counted, since a growing queue is what adds them.
+        """
+        queued = len(self.queues[lane])
+        if not queued and any(not w.in_flight for w in self.workers):
+            return 0.0
+        samples = self.service_times[lane]
+        if not samples:
+            return 0.0
+        return (queued + 1) * (sum(samples) / len(samples)) / max(1, len(self.workers), self.max_count)
+
+    def _admit(self, job: _Job):
+        """
+        Rejects interactive work the pool cannot start within the configured bounds, so overload
+        is answered right away instead of piling up. Batch work is bounded by its lane instead.
+        """
+        if job.lane != INTERACTIVE:
+            return
+        estimate = self.estimated_wait(job.lane)
+        queued = len(self.queues[job.lane])
+        if 0 < settings.WORKER_MAX_QUEUE_DEPTH <= queued:
+            reason = f"{queued} calculations are queued"
+        elif 0 < settings.WORKER_MAX_QUEUE_WAIT_SECONDS < estimate:
+            reason = f"the estimated wait is {estimate:.1f}s"
+        else:
+            return
+        self.rejected += 1
+        raise ExecutionOverloadedError(f"The calculation server is busy: {reason}", retry_after=estimate)
+
+    async def _submit(self, job: _Job) -> Dict[str, Any]:
+        job.enqueued_at = self.clock()
+        self._admit(job)
+        self.queues[job.lane].append(job)
+        self._dispatch()
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            # Drop the job if it never reached a worker, otherwise interrupt it;
+            # the worker running it is killed and swapped for a warm standby
+            if job in self.queues[job.lane]:
+                self.queues[job.lane].remove(job)
+            elif job.task is not None:
+                job.task.cancel()
+            raise
+
+    async def execute(
+        self,
+        script: str,
+        timeout: float = 5.0,
+        lane: str = INTERACTIVE,
+        affinity: Optional[str] = None,
+        projection: Projection = FULL_STATE,
+        profile: bool = False,
+    ) -> Dict[str, Any]:
+        task = {"script": script, "projection": _projection_task_value(projection), "profile": profile}
+        job = _Job(lambda worker: worker.execute(task, timeout), lane=lane, affinity=affinity)
+        return await self._submit(job)
+
+    def prepare(self, definitions: str, entry_point: str) -> str:
+        """Registers a sheet's definitions and returns a handle for execute_prepared."""
+        handle = prepared_handle(definitions, entry_point)
+        self.prepared[handle] = (definitions, entry_point)
+        self.prepared.move_to_end(handle)
+        while len(self.prepared) > settings.PREPARED_SHEET_CACHE_SIZE * len(self.workers):
+            self.prepared.popitem(last=False)
+        return handle
+
+    async def execute_prepared(
+        self,
+        handle: str,
+        input_overrides: Dict[str, Any],
+        timeout: float = 5.0,
+        lane: str = INTERACTIVE,
+        affinity: Optional[str] = None,
+        projection: Projection = FULL_STATE,
+        profile: bool = False,
+    ) -> Dict[str, Any]:
+        sources = self.prepared.get(handle)
+        if sources is None:
+            raise UnknownHandleError(f"Unknown prepared sheet handle: {handle}")
+
+        projected = _projection_task_value(projection)
+        job = _Job(
+            lambda worker: worker.execute_prepared(handle, sources, input_overrides, timeout, projected, profile),
+            handle,
+            lane,
+            affinity,
+        )
+        return await self._submit(job)
+
+    def shutdown(self):
+        """Stops every worker and standby process."""
+        for worker in self.workers:
+            worker.kill()
+        for spare in self.standby:
+            spare.kill()
+        self.standby.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self.queue_waits)
+        return {
+            "workers": len(self.workers),
+            "min_workers": self.min_count,
+            "max_workers": self.max_count,
+            "scale_ups": self.scale_ups,
+            "scale_downs": self.scale_downs,
+            "scale_events": list(self.scale_events),
+            "standby": len(self.standby),
+            "standby_ready": sum(1 for p in self.standby if p.ready),
+            "standby_swaps": self.standby_swaps,
+            "recycles": self.retired_recycles + sum(w.recycles for w in self.workers),
+            "in_flight": sum(1 for w in self.workers if w.in_flight),
+            "queue_depth": sum(len(queue) for queue in self.queues.values()),
+            "lanes": {
+                lane: {"queued": len(self.queues[lane]), "in_flight": sum(1 for w in self.workers if w.lane == lane)}
+                for lane in LANES
+            },
+            "queue_wait_p50": _percentile(waits, 0.5),
+            "queue_wait_p95": _percentile(waits, 0.95),
+            "queue_wait_max": waits[-1] if waits else 0.0,
+            "estimated_wait": self.estimated_wait(),
+            "rejected": self.rejected,
+            "affinity": {"preferred": self.affinity_preferred, "overflow": self.affinity_overflow},
+            "per_worker": [
+                {
+                    "index": w.index,
+                    "in_flight": w.in_flight,
+                    "tasks_completed": w.tasks_completed,
+                    "code_cache": w.code_cache_stats,
+                    "code_cache_hit_rate": _hit_rate(
+                        w.code_cache_stats.get("hits", 0), w.code_cache_stats.get("misses", 0)
+                    ),
+                    "prepared": {"hits": w.prepared_hits, "misses": w.prepared_misses},
+                    "prepared_hit_rate": _hit_rate(w.prepared_hits, w.prepared_misses),
+                    "node_memo": w.node_memo_stats,
+                    "node_memo_hit_rate": _hit_rate(
+                        w.node_memo_stats.get("hits", 0), w.node_memo_stats.get("misses", 0)
+                    ),
+                    "process_tasks": w.process_tasks,
+                    "rss_mb": round(w.rss_bytes / (1024 * 1024), 1),
+                    "cpu_seconds": round(w.cpu_seconds, 2),
+                    "cpus": sorted(w.cpus) if w.cpus else None,
+                }
+                for w in self.workers
+            ],
+        }
+
+
+# Global Pool Instances
 _worker_pool: Optional[WorkerPool] = None
+# Runs scripts that embed admin-approved sheet versions, apart from all other work
+_trusted_worker_pool: Optional[WorkerPool] = None
 _init_lock = threading.Lock()
 
 
@@ -369,12 +1718,295 @@ def _get_worker_pool() -> WorkerPool:
     if _worker_pool is None:
         with _init_lock:
             if _worker_pool is None:
-                _worker_pool = WorkerPool(settings.WORKER_COUNT)
+                _worker_pool = WorkerPool(
+                    settings.WORKER_COUNT, min_count=settings.WORKER_MIN_COUNT, max_count=settings.WORKER_MAX_COUNT
+                )
     return _worker_pool
 
 
-async def execute_full_script(script: str, timeout: float = 5.0) -> Dict[str, Any]:
+def _get_trusted_worker_pool() -> WorkerPool:
+    global _trusted_worker_pool
+    if _trusted_worker_pool is None:
+        with _init_lock:
+            if _trusted_worker_pool is None:
+                _trusted_worker_pool = WorkerPool(
+                    settings.TRUSTED_WORKER_COUNT, trusted_versions=frozenset(_trusted_version_ids())
+                )
+    return _trusted_worker_pool
+
+
+def _trusted_version_ids() -> Set[str]:
+    return {version_id.lower() for version_id in settings.TRUSTED_SHEET_VERSIONS}
+
+
+def trusted_versions_in(definitions: str) -> Set[str]:
+    """Admin-approved sheet versions among the classes of generated definitions."""
+    return {m.group(1).lower() for m in VERSIONED_BLOCK_PATTERN.finditer(definitions)} & _trusted_version_ids()
+
+
+def _pool_for(definitions: str) -> WorkerPool:
+    if settings.TRUSTED_WORKER_COUNT > 0 and trusted_versions_in(definitions):
+        return _get_trusted_worker_pool()
+    return _get_worker_pool()
+
+
+class LocalExecutor:
+    """Runs calculations on the worker pools of this process."""
+
+    def start(self):
+        """Starts the default pool up front instead of on the first calculation."""
+        _get_worker_pool()
+
+    async def execute(
+        self,
+        script: str,
+        timeout: float = 5.0,
+        lane: str = INTERACTIVE,
+        affinity: Optional[str] = None,
+        projection: Projection = FULL_STATE,
+        profile: bool = False,
+    ) -> Dict[str, Any]:
+        return await _pool_for(script).execute(script, timeout, lane, affinity, projection, profile)
+
+    def prepare(self, definitions: str, entry_point: str) -> str:
+        return _pool_for(definitions).prepare(definitions, entry_point)
+
+    async def execute_prepared(
+        self,
+        handle: str,
+        input_overrides: Dict[str, Any],
+        timeout: float = 5.0,
+        lane: str = INTERACTIVE,
+        affinity: Optional[str] = None,
+        projection: Projection = FULL_STATE,
+        profile: bool = False,
+    ) -> Dict[str, Any]:
+        pool = _trusted_worker_pool
+        if pool is None or handle not in pool.prepared:
+            pool = _get_worker_pool()
+        return await pool.execute_prepared(handle, input_overrides, timeout, lane, affinity, projection, profile)
+
+    def capacity(self) -> Dict[str, Any]:
+        """What the default pool can take on, advertised to clients spreading work over several services."""
+        pool = _get_worker_pool()
+        return {
+            "workers": len(pool.workers),
+            "max_workers": pool.max_count,
+            "in_flight": sum(1 for w in pool.workers if w.in_flight),
+            "queued": sum(len(queue) for queue in pool.queues.values()),
+            "estimated_wait": pool.estimated_wait(),
+        }
+
+    async def pool_stats(self) -> List[Tuple[Dict[str, str], Dict[str, Any]]]:
+        """Stats of the pools started so far, each with the labels it is exported under."""
+        pools = (("default", _worker_pool), ("trusted", _trusted_worker_pool))
+        return [({"pool": name}, pool.stats()) for name, pool in pools if pool is not None]
+
+    def shutdown(self):
+        global _worker_pool, _trusted_worker_pool
+        with _init_lock:
+            for pool in (_worker_pool, _trusted_worker_pool):
+                if pool is not None:
+                    pool.shutdown()
+            _worker_pool = _trusted_worker_pool = None
+
+
+# Local pools, or a client of one or more execution services (see executor.py)
+_executor: Optional[Any] = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _init_lock:
+            if _executor is None:
+                # The client module builds on this one, so it is only imported when used
+                if settings.EXECUTION_NODES:
+                    from .executor import ExecutorRegistry
+
+                    _executor = ExecutorRegistry(
+                        settings.EXECUTION_NODES,
+                        settings.EXECUTOR_TOKEN,
+                        settings.EXECUTION_NODE_HEALTH_INTERVAL_SECONDS,
+                    )
+                elif settings.EXECUTOR_SOCKET:
+                    from .executor import ExecutorClient
+
+                    _executor = ExecutorClient(settings.EXECUTOR_SOCKET, settings.EXECUTOR_TOKEN)
+                else:
+                    _executor = LocalExecutor()
+    return _executor
+
+
+# Pool-wide metrics exported on /metrics: (name, type, description, value from WorkerPool.stats())
+POOL_METRICS: List[Tuple[str, str, str, Callable[[Dict[str, Any]], Any]]] = [
+    ("parascope_pool_workers", "gauge", "Workers in the pool.", lambda s: s["workers"]),
+    ("parascope_pool_max_workers", "gauge", "Size the pool may grow to.", lambda s: s["max_workers"]),
+    ("parascope_pool_standby", "gauge", "Warm standby processes.", lambda s: s["standby"]),
+    ("parascope_pool_in_flight", "gauge", "Workers running a calculation.", lambda s: s["in_flight"]),
+    ("parascope_pool_queue_depth", "gauge", "Calculations waiting for a worker.", lambda s: s["queue_depth"]),
+    (
+        "parascope_pool_estimated_wait_seconds",
+        "gauge",
+        "Estimated queue wait of a new interactive calculation.",
+        lambda s: s["estimated_wait"],
+    ),
+    ("parascope_pool_scale_ups_total", "counter", "Workers added under load.", lambda s: s["scale_ups"]),
+    ("parascope_pool_scale_downs_total", "counter", "Idle workers retired.", lambda s: s["scale_downs"]),
+    (
+        "parascope_pool_standby_swaps_total",
+        "counter",
+        "Worker processes started from a warm standby.",
+        lambda s: s["standby_swaps"],
+    ),
+    ("parascope_pool_recycles_total", "counter", "Worker processes recycled.", lambda s: s["recycles"]),
+    ("parascope_pool_rejected_total", "counter", "Calculations rejected as overload.", lambda s: s["rejected"]),
+    (
+        "parascope_pool_affinity_preferred_total",
+        "counter",
+        "Calculations with an affinity key that ran on their preferred worker.",
+        lambda s: s["affinity"]["preferred"],
+    ),
+    (
+        "parascope_pool_affinity_overflow_total",
+        "counter",
+        "Calculations with an affinity key that overflowed to another worker.",
+        lambda s: s["affinity"]["overflow"],
+    ),
+]
+
+# Per-worker metrics, from the entries of WorkerPool.stats()["per_worker"]. The cache counters
+# are those of the worker's current process, so they restart when it is recycled or replaced.
+WORKER_METRICS: List[Tuple[str, str, str, Callable[[Dict[str, Any]], Any]]] = [
+    ("parascope_worker_tasks_total", "counter", "Calculations run by the worker.", lambda w: w["tasks_completed"]),
+    ("parascope_worker_rss_megabytes", "gauge", "Resident memory of the worker process.", lambda w: w["rss_mb"]),
+    (
+        "parascope_worker_code_cache_hits_total",
+        "counter",
+        "Compiled code blocks reused by the worker process.",
+        lambda w: w["code_cache"].get("hits"),
+    ),
+    (
+        "parascope_worker_code_cache_misses_total",
+        "counter",
+        "Code blocks the worker process had to compile.",
+        lambda w: w["code_cache"].get("misses"),
+    ),
+    (
+        "parascope_worker_code_cache_hit_rate",
+        "gauge",
+        "Share of code blocks found compiled.",
+        lambda w: w["code_cache_hit_rate"],
+    ),
+    (
+        "parascope_worker_prepared_hits_total",
+        "counter",
+        "Prepared runs that found their sheet loaded.",
+        lambda w: w["prepared"]["hits"],
+    ),
+    (
+        "parascope_worker_prepared_misses_total",
+        "counter",
+        "Prepared runs that had to load their sheet.",
+        lambda w: w["prepared"]["misses"],
+    ),
+    (
+        "parascope_worker_prepared_hit_rate",
+        "gauge",
+        "Share of prepared runs that found their sheet loaded.",
+        lambda w: w["prepared_hit_rate"],
+    ),
+    (
+        "parascope_worker_node_memo_hits_total",
+        "counter",
+        "Function node results reused from the worker's memo.",
+        lambda w: w["node_memo"].get("hits"),
+    ),
+    (
+        "parascope_worker_node_memo_misses_total",
+        "counter",
+        "Function node results the worker had to compute.",
+        lambda w: w["node_memo"].get("misses"),
+    ),
+    (
+        "parascope_worker_node_memo_hit_rate",
+        "gauge",
+        "Share of function node results reused from the memo.",
+        lambda w: w["node_memo_hit_rate"],
+    ),
+]
+
+
+def render_pool_metrics(pools: List[Tuple[Dict[str, str], Dict[str, Any]]]) -> List[str]:
+    """Renders the stats of labelled pools (see LocalExecutor.pool_stats) in the Prometheus text format."""
+    lines = []
+    for name, kind, description, value in POOL_METRICS:
+        lines += render_samples(name, kind, description, ((labels, value(stats)) for labels, stats in pools))
+    workers = [
+        ({**labels, "worker": str(worker["index"])}, worker)
+        for labels, stats in pools
+        for worker in stats["per_worker"]
+    ]
+    for name, kind, description, value in WORKER_METRICS:
+        # Hit rates and counters are left out until the worker has reported any
+        samples = [(labels, value(worker)) for labels, worker in workers]
+        lines += render_samples(name, kind, description, [(labels, v) for labels, v in samples if v is not None])
+    return lines
+
+
+async def worker_pool_metrics() -> List[str]:
+    """Metrics of the worker pools, whether they run in this process or in execution services."""
+    try:
+        pools = await _get_executor().pool_stats()
+    except ExecutorUnavailableError:
+        return []
+    return render_pool_metrics(pools)
+
+
+def shutdown_worker_pool():
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown()
+
+
+async def execute_full_script(
+    script: str,
+    timeout: float = 5.0,
+    lane: str = INTERACTIVE,
+    affinity: Optional[str] = None,
+    projection: Projection = FULL_STATE,
+    profile: bool = False,
+) -> Dict[str, Any]:
     """
     Executes the script using a pool of persistent workers.
+    Scripts with the same `affinity` key are preferably run by the same worker.
+    `projection` limits the returned results to OUTPUTS_ONLY or to a collection of node ids.
+    With `profile`, each node result includes its wall time, CPU time and peak allocation.
+    """
+    return await _get_executor().execute(script, timeout, lane, affinity, projection, profile)
+
+
+def prepare_sheet(definitions: str, entry_point: str) -> str:
+    """
+    Registers generated class definitions with the pool and returns a handle.
+    The definitions are only sent to a worker the first time the handle runs there.
+    """
+    return _get_executor().prepare(definitions, entry_point)
+
+
+async def execute_prepared(
+    handle: str,
+    input_overrides: Dict[str, Any],
+    timeout: float = 5.0,
+    lane: str = INTERACTIVE,
+    affinity: Optional[str] = None,
+    projection: Projection = FULL_STATE,
+    profile: bool = False,
+) -> Dict[str, Any]:
+    """
+    Runs a prepared sheet with the given input overrides.
+    Runs with the same `affinity` key (by default the handle) are preferably run by the same worker.
+    `projection` and `profile` work like in execute_full_script.
     """
-    return await _get_worker_pool().execute(script, timeout)
+    return await _get_executor().execute_prepared(handle, input_overrides, timeout, lane, affinity, projection, profile)
@@ -0,0 +1,577 @@
+"""
+Execution services.
+
+Every web process normally runs its own worker pools. Instead, calculations can be sent to
+execution services started with:
+
+    python -m src.core.executor
+
+A service listens on EXECUTOR_SOCKET, a Unix socket path or a TCP "host:port". With
+EXECUTOR_SOCKET set, a web process sends all calculations to that one service, so every web
+process on the host shares one set of workers, caches and one scheduler. With EXECUTION_NODES
+set, a web process spreads calculations over several services, e.g. on separate compute hosts,
+using their advertised capacity and failing over when one goes down.
+
+Requests and replies are pickled and framed like multiprocessing connections. Pickle runs
+arbitrary code on load, so Unix sockets are only accessible to the user running the service,
+and clients must present EXECUTOR_TOKEN before anything they send is unpickled (required over TCP).
+"""
+
+import asyncio
+import hashlib
+import hmac
+import itertools
+import logging
+import os
+import pickle
+import signal
+import struct
+import time
+import traceback
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from .config import settings
+from .exceptions import ExecutionOverloadedError, ExecutorUnavailableError, UnknownHandleError
+from .execution import (
+    FULL_STATE,
+    INTERACTIVE,
+    LocalExecutor,
+    Projection,
+    prepared_handle,
+    release_result,
+)
+from .metrics import observe_timings
+
+logger = logging.getLogger(__name__)
+
+
+async def _read_frame(reader: asyncio.StreamReader, limit: Optional[int] = None) -> Optional[bytes]:
+    """
+    Reads one message framed by _send, or returns None once the peer closed the connection
+    or announced a message larger than `limit`.
+    """
+    try:
+        (size,) = struct.unpack("!i", await reader.readexactly(4))
+        if size == -1:
+            (size,) = struct.unpack("!Q", await reader.readexactly(8))
+        if limit is not None and size > limit:
+            return None
+        return await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def _write_frame(writer: asyncio.StreamWriter, payload: bytes):
+    if len(payload) > 0x7FFFFFFF:
+        writer.write(struct.pack("!iQ", -1, len(payload)))
+    else:
+        writer.write(struct.pack("!i", len(payload)))
+    writer.write(payload)
+
+
+def _send(writer: asyncio.StreamWriter, message: Dict[str, Any]):
+    _write_frame(writer, pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _parse_address(address: str) -> Union[str, Tuple[str, int]]:
+    """A "host:port" address is a TCP address; anything else is the path of a Unix socket."""
+    host, sep, port = address.rpartition(":")
+    if sep and host and "/" not in address and port.isdigit():
+        return host.strip("[]"), int(port)
+    return address
+
+
+def _picklable(projection: Projection) -> Projection:
+    # Node ids may come from a generator or a dict view
+    return projection if isinstance(projection, str) else frozenset(str(node_id) for node_id in projection)
+
+
+class ExecutorServer:
+    """Serves an executor's calculations to clients connecting to a Unix socket or TCP address."""
+
+    def __init__(self, executor: LocalExecutor, address: str, token: str = ""):
+        self.executor = executor
+        self.address = _parse_address(address)
+        self.token = token.encode()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        if isinstance(self.address, tuple):
+            if not self.token:
+                raise ValueError("Set EXECUTOR_TOKEN before listening on a TCP address")
+            host, port = self.address
+            self._server = await asyncio.start_server(self._handle_connection, host, port)
+        else:
+            if os.path.exists(self.address):
+                # Left behind by a service that did not shut down cleanly
+                os.unlink(self.address)
+            previous_umask = os.umask(0o177)
+            try:
+                self._server = await asyncio.start_unix_server(self._handle_connection, self.address)
+            finally:
+                os.umask(previous_umask)
+        logger.info("Execution service listening on %s", self.listening_on)
+
+    @property
+    def listening_on(self) -> str:
+        if isinstance(self.address, tuple) and self._server is not None:
+            host, port = self._server.sockets[0].getsockname()[:2]
+            return f"{host}:{port}"
+        return str(self.address)
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Requests of this client still running: request id -> task
+        running: Dict[int, asyncio.Task] = {}
+        try:
+            token = await _read_frame(reader, limit=1024)
+            if token is None or not hmac.compare_digest(token, self.token):
+                logger.warning("Rejected execution service client %s: wrong token", writer.get_extra_info("peername"))
+                return
+            while True:
+                frame = await _read_frame(reader)
+                if frame is None:
+                    break
+                message = pickle.loads(frame)
+                request_id = message["id"]
+                if message["op"] == "cancel":
+                    task = running.pop(request_id, None)
+                    if task is not None:
+                        task.cancel()
+                    continue
+                task = asyncio.create_task(self._serve(message, writer))
+                running[request_id] = task
+                task.add_done_callback(lambda _, request_id=request_id: running.pop(request_id, None))
+        except (ConnectionError, pickle.UnpicklingError, KeyError) as e:
+            logger.warning("Dropping execution service client: %s", e)
+        finally:
+            # Nobody is waiting for these anymore; interrupting them frees their workers
+            for task in running.values():
+                task.cancel()
+            writer.close()
+
+    async def _serve(self, message: Dict[str, Any], writer: asyncio.StreamWriter):
+        started = time.perf_counter()
+        reply: Dict[str, Any] = {"id": message["id"]}
+        result = None
+        try:
+            if message["op"] == "execute":
+                result = await self.executor.execute(**message["args"])
+            elif message["op"] == "execute_prepared":
+                if "sources" in message:
+                    self.executor.prepare(*message["sources"])
+                try:
+                    result = await self.executor.execute_prepared(**message["args"])
+                except UnknownHandleError:
+                    reply["unprepared"] = True
+            elif message["op"] == "health":
+                reply["capacity"] = self.executor.capacity()
+            elif message["op"] == "stats":
+                reply["stats"] = await self.executor.pool_stats()
+            else:
+                raise ValueError(f"Unknown operation: {message['op']}")
+            if result is not None:
+                # Segments are released below; the arrays are copied into the reply
+                reply["result"] = {key: value for key, value in result.items() if key != "shared_memory"}
+        except ValueError as e:
+            reply["invalid"] = str(e)
+        except ExecutionOverloadedError as e:
+            reply["overloaded"] = str(e)
+            reply["retry_after"] = e.retry_after
+        except Exception:
+            reply["error"] = traceback.format_exc()
+
+        reply["served"] = time.perf_counter() - started
+        try:
+            _send(writer, reply)
+            await writer.drain()
+        except ConnectionError:
+            pass  # The client went away; its other requests are cancelled by the connection handler
+        finally:
+            if result is not None:
+                release_result(result)
+
+
+class ExecutorClient:
+    """
+    Sends calculations to an execution service; a drop-in replacement for LocalExecutor.
+    Requests are multiplexed over one connection per process, which is reopened after a failure.
+    """
+
+    def __init__(self, address: str, token: str = ""):
+        self.address = address
+        self.token = token.encode()
+        # Sources of prepared sheets, sent along when the service does not know a handle (yet)
+        self.prepared: OrderedDict[str, Tuple[str, str]] = OrderedDict()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count()
+        self._connect_lock = asyncio.Lock()
+
+    async def _connection(self) -> asyncio.StreamWriter:
+        async with self._connect_lock:
+            if self._writer is None or self._writer.is_closing():
+                address = _parse_address(self.address)
+                try:
+                    if isinstance(address, tuple):
+                        reader, writer = await asyncio.open_connection(*address)
+                    else:
+                        reader, writer = await asyncio.open_unix_connection(address)
+                except OSError as e:
+                    raise ExecutorUnavailableError(
+                        f"The execution service at {self.address} is unavailable: {e}"
+                    ) from e
+                _write_frame(writer, self.token)
+                self._writer = writer
+                self._reader_task = asyncio.create_task(self._read_replies(reader, writer))
+            return self._writer
+
+    async def _read_replies(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                frame = await _read_frame(reader)
+                if frame is None:
+                    break
+                reply = pickle.loads(frame)
+                future = self._pending.pop(reply["id"], None)
+                if future is not None and not future.done():
+                    future.set_result(reply)
+        except (ConnectionError, pickle.UnpicklingError) as e:
+            logger.warning("Lost connection to the execution service: %s", e)
+        finally:
+            writer.close()
+            if self._writer is writer:
+                self._writer = None
+            pending, self._pending = self._pending, {}
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(ExecutorUnavailableError("The execution service closed the connection"))
+
+    async def _request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        writer = await self._connection()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        started = time.perf_counter()
+        try:
+            _send(writer, {**message, "id": request_id})
+            await writer.drain()
+            reply = await future
+        except ConnectionError as e:
+            self._pending.pop(request_id, None)
+            raise ExecutorUnavailableError(f"The execution service is unavailable: {e}") from e
+        except asyncio.CancelledError:
+            # Interrupts the calculation in the service as well
+            if self._pending.pop(request_id, None) is not None and not writer.is_closing():
+                _send(writer, {"id": request_id, "op": "cancel"})
+            raise
+
+        if "invalid" in reply:
+            raise ValueError(reply["invalid"])
+        if "overloaded" in reply:
+            raise ExecutionOverloadedError(reply["overloaded"], reply["retry_after"])
+        if "error" in reply:
+            reply["result"] = {"success": False, "error": f"Execution service error: {reply['error']}"}
+        result = reply.get("result")
+        if result is not None:
+            timings = result.setdefault("timings", {})
+            timings["executor_transfer"] = max(0.0, time.perf_counter() - started - reply["served"])
+            # The service records its own metrics; these feed this process's /metrics
+            observe_timings(timings)
+        return reply
+
+    async def execute(
+        self,
+        script: str,
+        timeout: float = 5.0,
+        lane: str = INTERACTIVE,
+        affinity: Optional[str] = None,
+        projection: Projection = FULL_STATE,
+        profile: bool = False,
+    ) -> Dict[str, Any]:
+        args = {
+            "script": script,
+            "timeout": timeout,
+            "lane": lane,
+            "affinity": affinity,
+            "projection": _picklable(projection),
+            "profile": profile,
+        }
+        reply = await self._request({"op": "execute", "args": args})
+        return reply.get("result") or {"success": False, "error": "Execution service returned no result"}
+
+    def prepare(self, definitions: str, entry_point: str) -> str:
+        handle = prepared_handle(definitions, entry_point)
+        self.prepared[handle] = (definitions, entry_point)
+        self.prepared.move_to_end(handle)
+        while len(self.prepared) > settings.PREPARED_SHEET_CACHE_SIZE * settings.WORKER_MAX_COUNT:
+            self.prepared.popitem(last=False)
+        return handle
+
+    async def execute_prepared(
+        self,
+        handle: str,
+        input_overrides: Dict[str, Any],
+        timeout: float = 5.0,
+        lane: str = INTERACTIVE,
+        affinity: Optional[str] = None,
+        projection: Projection = FULL_STATE,
+        profile: bool = False,
+    ) -> Dict[str, Any]:
+        sources = self.prepared.get(handle)
+        if sources is None:
+            raise UnknownHandleError(f"Unknown prepared sheet handle: {handle}")
+
+        args = {
+            "handle": handle,
+            "input_overrides": input_overrides,
+            "timeout": timeout,
+            "lane": lane,
+            "affinity": affinity,
+            "projection": _picklable(projection),
+            "profile": profile,
+        }
+        reply = await self._request({"op": "execute_prepared", "args": args})
+        if reply.get("unprepared"):
+            # First run of this sheet since the service started (or since it evicted the sheet)
+            reply = await self._request({"op": "execute_prepared", "args": args, "sources": sources})
+        return reply.get("result") or {"success": False, "error": "Execution service returned no result"}
+
+    async def health(self) -> Dict[str, Any]:
+        """The capacity the service advertises: its workers, how many are busy and its queue."""
+        capacity = (await self._request({"op": "health"})).get("capacity")
+        if capacity is None:
+            raise ExecutorUnavailableError(f"The execution service at {self.address} did not report its capacity")
+        return capacity
+
+    async def pool_stats(self) -> List[Tuple[Dict[str, str], Dict[str, Any]]]:
+        """Stats of the service's worker pools, for /metrics."""
+        return (await self._request({"op": "stats"})).get("stats", [])
+
+    def disconnect(self):
+        """Closes the connection; requests still waiting on it fail with ExecutorUnavailableError."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def shutdown(self):
+        self.disconnect()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+
+
+def _node_rank(key: str, address: str) -> int:
+    # Rendezvous hashing, as for workers within a pool: a node going down only moves its own keys
+    digest = hashlib.blake2b(f"{key}\0{address}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class ExecutionNode:
+    """An execution service in a registry, with the capacity it last advertised."""
+
+    def __init__(self, address: str, token: str = ""):
+        self.address = address
+        self.client = ExecutorClient(address, token)
+        self.healthy = True  # Until a health check or a request says otherwise
+        self.capacity: Dict[str, Any] = {}
+        self.outstanding = 0  # Requests this process is waiting on
+        self.failures = 0
+
+    def load(self) -> float:
+        """Busy share of the node's workers: this process's requests plus what others have queued there."""
+        return (self.outstanding + self.capacity.get("queued", 0)) / max(1, self.capacity.get("max_workers", 1))
+
+
+class ExecutorRegistry:
+    """
+    Spreads calculations over several execution services, a drop-in replacement for LocalExecutor.
+    Work goes to the least loaded healthy node; runs with an affinity key stay on the node the key
+    ranks first while it has a free worker. Nodes are health-checked periodically, and a calculation
+    whose node fails or is overloaded is retried on the next one. Calculations have no side effects,
+    so running one again elsewhere is safe.
+    """
+
+    def __init__(self, addresses: List[str], token: str = "", health_interval: float = 5.0):
+        if not addresses:
+            raise ValueError("An execution registry needs at least one node")
+        self.nodes = [ExecutionNode(address, token) for address in addresses]
+        self.health_interval = health_interval
+        self.failovers = 0
+        self._health_task: Optional[asyncio.Task] = None
+
+    def _ensure_health_checks(self):
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.create_task(self._check_health_forever())
+
+    async def _check_health_forever(self):
+        while True:
+            await asyncio.gather(*(self.check_health(node) for node in self.nodes))
+            await asyncio.sleep(self.health_interval)
+
+    async def check_health(self, node: ExecutionNode):
+        try:
+            node.capacity = await asyncio.wait_for(node.client.health(), timeout=self.health_interval)
+        except (ExecutorUnavailableError, asyncio.TimeoutError, ConnectionError) as e:
+            if node.healthy:
+                logger.warning("Execution node %s is down: %s", node.address, e or type(e).__name__)
+            node.healthy = False
+            # A node that stopped answering may never reply to what it was sent; fail it over now
+            node.client.disconnect()
+        else:
+            if not node.healthy:
+                logger.info("Execution node %s is back", node.address)
+            node.healthy = True
+
+    def _pick(self, affinity: Optional[str], tried: List[ExecutionNode]) -> Optional[ExecutionNode]:
+        candidates = [node for node in self.nodes if node.healthy and node not in tried]
+        if not candidates:
+            # Every node looks down; try the ones not tried yet anyway rather than failing outright
+            candidates = [node for node in self.nodes if node not in tried]
+        if not candidates:
+            return None
+        if affinity is not None:
+            ranked = sorted(candidates, key=lambda node: _node_rank(affinity, node.address), reverse=True)
+            free = next((node for node in ranked if node.load() < 1), None)
+            if free is not None:
+                return free
+        return min(candidates, key=ExecutionNode.load)
+
+    async def _dispatch(
+        self, affinity: Optional[str], call: Callable[[ExecutorClient], Awaitable[Dict[str, Any]]]
+    ) -> Dict[str, Any]:
+        self._ensure_health_checks()
+        tried: List[ExecutionNode] = []
+        overloaded: List[ExecutionOverloadedError] = []
+        while True:
+            node = self._pick(affinity, tried)
+            if node is None:
+                if overloaded and len(overloaded) == len(tried):
+                    raise min(overloaded, key=lambda e: e.retry_after)
+                raise ExecutorUnavailableError("No execution node is available")
+            if tried:
+                self.failovers += 1
+            tried.append(node)
+            node.outstanding += 1
+            try:
+                return await call(node.client)
+            except ExecutorUnavailableError as e:
+                node.healthy = False
+                node.failures += 1
+                logger.warning("Execution node %s failed, trying another one: %s", node.address, e)
+            except ExecutionOverloadedError as e:
+                overloaded.append(e)
+            finally:
+                node.outstanding -= 1
+
+    async def execute(
+        self,
+        script: str,
+        timeout: float = 5.0,
+        lane: str = INTERACTIVE,
+        affinity: Optional[str] = None,
+        projection: Projection = FULL_STATE,
+        profile: bool = False,
+    ) -> Dict[str, Any]:
+        return await self._dispatch(
+            affinity, lambda client: client.execute(script, timeout, lane, affinity, projection, profile)
+        )
+
+    def prepare(self, definitions: str, entry_point: str) -> str:
+        # Only recorded here; each node receives the sources on its first run of the handle
+        for node in self.nodes:
+            node.client.prepare(definitions, entry_point)
+        return prepared_handle(definitions, entry_point)
+
+    async def execute_prepared(
+        self,
+        handle: str,
+        input_overrides: Dict[str, Any],
+        timeout: float = 5.0,
+        lane: str = INTERACTIVE,
+        affinity: Optional[str] = None,
+        projection: Projection = FULL_STATE,
+        profile: bool = False,
+    ) -> Dict[str, Any]:
+        return await self._dispatch(
+            affinity or handle,
+            lambda client: client.execute_prepared(
+                handle, input_overrides, timeout, lane, affinity, projection, profile
+            ),
+        )
+
+    async def pool_stats(self) -> List[Tuple[Dict[str, str], Dict[str, Any]]]:
+        """Stats of the worker pools of every node that answers, labelled with its address."""
+
+        async def node_stats(node: ExecutionNode):
+            try:
+                pools = await asyncio.wait_for(node.client.pool_stats(), timeout=self.health_interval)
+            except (ExecutorUnavailableError, asyncio.TimeoutError, ConnectionError):
+                return []
+            return [({"node": node.address, **labels}, stats) for labels, stats in pools]
+
+        per_node = await asyncio.gather(*(node_stats(node) for node in self.nodes if node.healthy))
+        return [pool for pools in per_node for pool in pools]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "failovers": self.failovers,
+            "nodes": [
+                {
+                    "address": node.address,
+                    "healthy": node.healthy,
+                    "outstanding": node.outstanding,
+                    "failures": node.failures,
+                    "capacity": node.capacity,
+                }
+                for node in self.nodes
+            ],
+        }
+
+    def shutdown(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for node in self.nodes:
+            node.client.shutdown()
+
+
+async def serve(address: str, token: str = ""):
+    executor = LocalExecutor()
+    executor.start()
+    server = ExecutorServer(executor, address, token)
+    await server.start()
+
+    serving = asyncio.create_task(server.serve_forever())
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, serving.cancel)
+    try:
+        await serving
+    except asyncio.CancelledError:
+        pass
+    finally:
+        server.close()
+        executor.shutdown()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    if not settings.EXECUTOR_SOCKET:
+        raise SystemExit("Set EXECUTOR_SOCKET to the Unix socket path or host:port to listen on")
+    asyncio.run(serve(settings.EXECUTOR_SOCKET, settings.EXECUTOR_TOKEN))
+
+
+if __name__ == "__main__":
+    main()
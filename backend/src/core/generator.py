@@ -1,10 +1,11 @@
 import ast
 import asyncio
+import hashlib
 import keyword
 import re
 import textwrap
 import uuid
-from typing import Any, Dict, List, Optional, Set
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -12,6 +13,39 @@ from sqlalchemy.orm import selectinload
 
 from ..models.sheet import Connection, Node, Sheet, SheetVersion
 
+# Bump whenever the generated code changes shape; workers key persisted bytecode on it
+GENERATOR_VERSION = 2
+
+# Function nodes referring to any of these are never memoized: their results vary between calls
+IMPURE_NAMES = frozenset({"random", "time", "datetime", "secrets", "uuid"})
+
+
+def _is_impure_path(path: str) -> bool:
+    # numpy.random is as impure as random
+    return any(segment in IMPURE_NAMES for segment in path.split("."))
+
+
+def _is_impure(tree: ast.AST) -> bool:
+    for item in ast.walk(tree):
+        # The sheet instance is not part of the memo key either
+        if isinstance(item, ast.Name) and (item.id in IMPURE_NAMES or item.id == "self"):
+            return True
+        if isinstance(item, ast.Attribute) and item.attr in IMPURE_NAMES:
+            return True
+        # Full paths, so `from numpy import random as rnd` is caught before `rnd.normal()` hides it
+        if isinstance(item, ast.Import) and any(_is_impure_path(alias.name) for alias in item.names):
+            return True
+        if isinstance(item, ast.ImportFrom):
+            module = item.module or ""
+            if any(_is_impure_path(f"{module}.{alias.name}") for alias in item.names):
+                return True
+        if isinstance(item, ast.Call) and isinstance(item.func, ast.Name) and item.func.id == "getattr":
+            # getattr(np, "random") reaches the same attributes without naming them
+            name = item.args[1] if len(item.args) > 1 else None
+            if not (isinstance(name, ast.Constant) and isinstance(name.value, str)) or _is_impure_path(name.value):
+                return True
+    return False
+
 
 class CodeGenerator:
     def __init__(self, session: AsyncSession):
@@ -45,18 +79,36 @@ class CodeGenerator:
         Generates the complete Python script including all class definitions
         and the execution entry point.
         """
+        definitions, root_class_name = await self._generate_definitions(root_sheet)
+        return definitions + self._get_entry_point(root_class_name, repr(input_overrides))
+
+    async def generate_prepared_sheet(self, root_sheet: Sheet, version_id: Optional[str] = None) -> Tuple[str, str]:
+        """
+        Generates the class definitions and an entry point that reads the
+        overrides from an injected `input_overrides` global, so the same
+        definitions can be executed repeatedly with different inputs.
+        Pass `version_id` when `root_sheet` is a version snapshot (see sheet_from_version),
+        so its class is tagged with the version like it is when embedded in another sheet.
+        """
+        definitions, root_class_name = await self._generate_definitions(root_sheet, version_id)
+        return definitions, self._get_entry_point(root_class_name, "input_overrides")
+
+    async def _generate_definitions(self, root_sheet: Sheet, version_id: Optional[str] = None) -> Tuple[str, str]:
         # 1. Process dependencies and generate class definitions
-        root_class_name = await self._process_sheet_recursive(root_sheet)
+        root_class_name = await self._process_sheet_recursive(root_sheet, version_id)
 
-        # 2. Build the final script
+        # 2. Build the definitions part of the script
         header = self._get_script_header()
 
         definitions_code = "\n\n".join(self.definitions)
 
-        entry_point = f"""
+        return header + definitions_code, root_class_name
+
+    def _get_entry_point(self, root_class_name: str, overrides_expr: str) -> str:
+        return f"""
 # --- Execution Entry Point ---
 try:
-    overrides = {repr(input_overrides)}
+    overrides = {overrides_expr}
     sheet_instance = {root_class_name}(input_overrides=overrides)
     sheet_instance.run()
 except NodeExecutionError:
@@ -71,7 +123,6 @@ finally:
     else:
         results = {{}}
 """
-        return header + definitions_code + entry_point
 
     async def generate_sweep_script(
         self,
@@ -83,18 +134,38 @@ finally:
         """
         Generates a script that executes the sheet logic iteratively for a sweep.
         """
-        # 1. Process dependencies and generate class definitions
-        root_class_name = await self._process_sheet_recursive(root_sheet)
-
-        # 2. Build the final script
-        header = self._get_script_header()
+        definitions, root_class_name = await self._generate_definitions(root_sheet)
+        return definitions + self._get_sweep_entry_point(
+            root_class_name, repr(scenarios), static_overrides, output_node_ids
+        )
 
-        definitions_code = "\n\n".join(self.definitions)
+    async def generate_prepared_sweep(
+        self,
+        root_sheet: Sheet,
+        static_overrides: Dict[str, Any],
+        output_node_ids: List[str],
+    ) -> Tuple[str, str]:
+        """
+        Generates the class definitions and a sweep entry point that reads its
+        scenarios from an injected `input_overrides["scenarios"]`, so a sweep
+        can be executed in chunks.
+        """
+        definitions, root_class_name = await self._generate_definitions(root_sheet)
+        return definitions, self._get_sweep_entry_point(
+            root_class_name, 'input_overrides["scenarios"]', static_overrides, output_node_ids
+        )
 
-        entry_point = f"""
+    def _get_sweep_entry_point(
+        self,
+        root_class_name: str,
+        scenarios_expr: str,
+        static_overrides: Dict[str, Any],
+        output_node_ids: List[str],
+    ) -> str:
+        return f"""
 # --- Sweep Execution Entry Point ---
 try:
-    scenarios = {repr(scenarios)}
+    scenarios = {scenarios_expr}
     static_overrides = {repr(static_overrides)}
     output_node_ids = {repr(output_node_ids)}
     
@@ -184,7 +255,6 @@ except Exception as e:
     if 'results' not in locals():
         results = []
 """
-        return header + definitions_code + entry_point
 
     async def _process_sheet_recursive(self, sheet: Sheet, version_id: Optional[str] = None) -> str:
         processed_id = f"{sheet.id}:{version_id}" if version_id else str(sheet.id)
@@ -209,42 +279,18 @@ except Exception as e:
                     if isinstance(nested_version_id, str):
                         nested_version_id = uuid.UUID(nested_version_id)
 
-                    # Fetch from snapshot
-                    stmt = select(SheetVersion).where(SheetVersion.id == nested_version_id)
+                    # Fetch from snapshot, with the name of the sheet it belongs to
+                    stmt = (
+                        select(SheetVersion, Sheet.name)
+                        .join(Sheet, SheetVersion.sheet_id == Sheet.id)
+                        .where(SheetVersion.id == nested_version_id)
+                    )
                     result = await self.session.execute(stmt)
-                    version = result.scalars().first()
-
-                    if version:
-                        # Reconstruct virtual sheet from snapshot
-                        v_data = version.data
-                        v_nodes = [
-                            Node(
-                                id=uuid.UUID(n["id"]),
-                                type=n["type"],
-                                label=n["label"],
-                                inputs=n["inputs"],
-                                outputs=n["outputs"],
-                                data=n["data"],
-                            )
-                            for n in v_data.get("nodes", [])
-                        ]
-                        # Connections are needed for _generate_sheet_class
-                        v_connections = [
-                            Connection(
-                                id=uuid.UUID(c["id"]) if c.get("id") else uuid.uuid4(),
-                                source_id=uuid.UUID(c["source_id"]),
-                                target_id=uuid.UUID(c["target_id"]),
-                                source_port=c["source_port"],
-                                target_port=c["target_port"],
-                            )
-                            for c in v_data.get("connections", [])
-                        ]
-                        v_sheet = Sheet(
-                            id=version.sheet_id,
-                            name=f"{sheet.name}_v{version.version_tag}",
-                            nodes=v_nodes,
-                            connections=v_connections,
-                        )
+                    row = result.first()
+
+                    if row:
+                        version, nested_sheet_name = row
+                        v_sheet = self.sheet_from_version(version, nested_sheet_name)
                         await self._process_sheet_recursive(v_sheet, str(nested_version_id))
 
                 elif nested_sheet_id:
@@ -269,6 +315,43 @@ except Exception as e:
 
         return self._get_class_name(processed_id)
 
+    @staticmethod
+    def sheet_from_version(version: SheetVersion, sheet_name: str) -> Sheet:
+        """
+        Reconstructs a virtual sheet from a version snapshot.
+        It is named after its own sheet, so its class (and compiled code) is the same
+        whether the version is calculated directly or embedded in any parent.
+        """
+        v_data = version.data
+        v_nodes = [
+            Node(
+                id=uuid.UUID(n["id"]),
+                type=n["type"],
+                label=n["label"],
+                inputs=n["inputs"],
+                outputs=n["outputs"],
+                data=n["data"],
+            )
+            for n in v_data.get("nodes", [])
+        ]
+        # Connections are needed for _generate_sheet_class
+        v_connections = [
+            Connection(
+                id=uuid.UUID(c["id"]) if c.get("id") else uuid.uuid4(),
+                source_id=uuid.UUID(c["source_id"]),
+                target_id=uuid.UUID(c["target_id"]),
+                source_port=c["source_port"],
+                target_port=c["target_port"],
+            )
+            for c in v_data.get("connections", [])
+        ]
+        return Sheet(
+            id=version.sheet_id,
+            name=f"{sheet_name}_v{version.version_tag}",
+            nodes=v_nodes,
+            connections=v_connections,
+        )
+
     def _get_class_name(self, processed_id: str) -> str:
         if processed_id in self.sheet_class_names:
             return self.sheet_class_names[processed_id]
@@ -399,7 +482,11 @@ except Exception as e:
                 node_arg_mapping[nid][arg_name] = target_port
 
         # 3. Generate Methods
-        result_code = [f"@sheet('{sheet.id}')", f"class {class_name}(SheetBase):", "    pass"]
+        decorator = f"@sheet('{sheet.id}')"
+        if version_id:
+            # Versions are immutable, so workers may persist the compiled class
+            decorator += f"  # version {version_id} generator {GENERATOR_VERSION}"
+        result_code = [decorator, f"class {class_name}(SheetBase):", "    pass"]
 
         for node in sheet.nodes:
             # Skip comment nodes - they're for documentation only
@@ -438,7 +525,7 @@ except Exception as e:
 
             # Syntax Check
             try:
-                ast.parse(code)
+                tree = ast.parse(code)
             except SyntaxError as e:
                 full_msg = str(e)
                 if e.text:
@@ -466,8 +553,14 @@ def {method_name}(self, {args_str}):
 
             ret_stmt = f"    return {{{', '.join(ret_dict_entries)}}}" if ret_dict_entries else "    return {}"
 
+            # Pure nodes may be served from the worker's memo; the hash covers everything the result depends on
+            memo_arg = ""
+            if not node.data.get("impure") and not _is_impure(tree):
+                code_hash = hashlib.sha256(f"{args_str}\n{code}\n{ret_stmt}".encode()).hexdigest()
+                memo_arg = f', code_hash="{code_hash}"'
+
             return f"""
-@function_node("{nid}", inputs={dict_str}, label="{label_safe}")
+@function_node("{nid}", inputs={dict_str}, label="{label_safe}"{memo_arg})
 def {method_name}(self, {args_str}):
     # NODE_ID:{nid}
 {indented_code}
@@ -0,0 +1,79 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+# Upper bounds in seconds; calculations range from sub-millisecond recalculations to long sweeps
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30
+)  # fmt: skip
+
+
+class Histogram:
+    """Cumulative histogram per label value, rendered in the Prometheus text exposition format."""
+
+    def __init__(self, name: str, description: str, label: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = tuple(sorted(buckets))
+        # label value -> (count per bucket, +Inf count, sum)
+        self.series: Dict[str, Tuple[List[int], int, float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float):
+        with self._lock:
+            counts, total, value_sum = self.series.get(label_value) or ([0] * len(self.buckets), 0, 0.0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.series[label_value] = (counts, total + 1, value_sum + value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_value, (counts, total, value_sum) in sorted(self.series.items()):
+                label = f'{self.label}="{label_value}"'
+                for bound, count in zip(self.buckets, counts, strict=True):
+                    lines.append(f'{self.name}_bucket{{{label},le="{bound:g}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {total}')
+                lines.append(f"{self.name}_sum{{{label}}} {value_sum:.6f}")
+                lines.append(f"{self.name}_count{{{label}}} {total}")
+        return lines
+
+
+PHASE_SECONDS = Histogram(
+    "parascope_execution_phase_seconds",
+    "Time spent in each stage of a calculation.",
+    "phase",
+)
+
+
+def observe_timings(timings: Dict[str, float]):
+    for phase, seconds in timings.items():
+        PHASE_SECONDS.observe(phase, seconds)
+
+
+@contextmanager
+def timed(timings: Dict[str, float], phase: str) -> Iterator[None]:
+    """Adds the time spent in the block to `timings[phase]`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0.0) + time.perf_counter() - start
+
+
+def render_samples(
+    name: str, kind: str, description: str, samples: Iterable[Tuple[Dict[str, str], Union[int, float]]]
+) -> List[str]:
+    """A counter or gauge read at scrape time, one sample per label set."""
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        label = ",".join(f'{key}="{label_value}"' for key, label_value in labels.items())
+        lines.append(f"{name}{{{label}}} {value}" if label else f"{name} {value}")
+    return lines
+
+
+def render_metrics(extra: Iterable[str] = ()) -> str:
+    return "\n".join([*PHASE_SECONDS.render(), *extra]) + "\n"
@@ -0,0 +1,18 @@
+"""
+Template for worker processes started with the "forkserver" method.
+
+The forkserver imports this module once and forks every worker from itself,
+so workers start with the sandbox libraries already imported and their pages
+shared copy-on-write. Importing it has side effects; nothing else should.
+"""
+
+import gc
+
+from .config import settings
+from .execution import preload_libraries  # Also imports RestrictedPython and the runtime
+
+preload_libraries(settings.EXTRA_PRELOAD_MODULES, settings.WORKER_PRELOAD_SUBMODULES)
+
+# Objects imported so far live as long as the template; freezing them keeps the
+# garbage collector from touching (and un-sharing) their pages in forked workers.
+gc.freeze()
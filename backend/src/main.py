@@ -1,15 +1,19 @@
 import logging
+import math
 import traceback
 from contextlib import asynccontextmanager
 from pathlib import Path
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 from .api import attachments, auth, calculate, genai, locks, sheets, sweep
 from .core.config import settings
 from .core.database import AsyncSessionLocal, Base, engine
+from .core.exceptions import ExecutionOverloadedError, ExecutorUnavailableError
+from .core.execution import shutdown_worker_pool, worker_pool_metrics
+from .core.metrics import render_metrics
 from .core.seed import seed_database
 
 
@@ -28,6 +32,8 @@ async def lifespan(app: FastAPI):
 
     yield
 
+    shutdown_worker_pool()
+
 
 app = FastAPI(title="Parascope Backend", lifespan=lifespan)
 
@@ -50,6 +56,20 @@ app.include_router(attachments.router, prefix="/api/v1")
 app.include_router(genai.router, prefix="/api/v1/genai", tags=["genai"])
 
 
+@app.exception_handler(ExecutionOverloadedError)
+async def execution_overloaded_handler(request: Request, exc: ExecutionOverloadedError):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
+
+@app.exception_handler(ExecutorUnavailableError)
+async def executor_unavailable_handler(request: Request, exc: ExecutorUnavailableError):
+    return JSONResponse(status_code=503, content={"detail": str(exc)})
+
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     error_msg = str(exc)
@@ -78,3 +98,9 @@ async def root():
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Per-phase execution time histograms and worker pool counters in the Prometheus text format."""
+    return render_metrics(await worker_pool_metrics())
@@ -34,3 +34,4 @@ class SweepResponse(BaseModel):
     results: List[List[Any]]
     metadata: List[Dict[str, Any]] | None = None
     error: str | None = None
+    timings: Dict[str, float] = {}
@@ -211,6 +211,46 @@ async def test_calculate_preview(client: AsyncClient):
     assert response.status_code == 200
     assert response.json()["results"][node_id]["outputs"]["value"] == "42"
 
+    timings = response.json()["timings"]
+    for phase in ("generate", "queue_wait", "compile", "exec", "extract", "transfer", "enrich", "total"):
+        assert timings[phase] >= 0
+    assert timings["total"] >= timings["generate"] + timings["enrich"]
+
+    metrics = await client.get("/metrics")
+    assert metrics.status_code == 200
+    assert 'parascope_execution_phase_seconds_count{phase="exec"}' in metrics.text
+
+
+@pytest.mark.asyncio
+async def test_calculate_preview_profile(client: AsyncClient):
+    node_id = str(uuid4())
+    graph_data = {
+        "name": "Profiled",
+        "nodes": [
+            {
+                "id": node_id,
+                "type": "function",
+                "label": "Build",
+                "position_x": 0,
+                "position_y": 0,
+                "data": {"code": "y = len(list(range(100000)))"},
+                "outputs": [{"key": "y"}],
+            }
+        ],
+        "connections": [],
+    }
+
+    response = await client.post("/api/v1/calculate/?profile=1", json={"graph": graph_data, "inputs": {}})
+    assert response.status_code == 200
+    node_profile = response.json()["results"][node_id]["profile"]
+    assert node_profile["wall_seconds"] >= 0
+    assert node_profile["cpu_seconds"] >= 0
+    assert node_profile["peak_bytes"] > 100000
+    assert response.json()["profile"][0]["node_id"] == node_id
+
+    response = await client.post("/api/v1/calculate/", json={"graph": graph_data, "inputs": {}})
+    assert "profile" not in response.json()["results"][node_id]
+
 
 @pytest.mark.asyncio
 async def test_cycle_detection(client: AsyncClient):
@@ -1,8 +1,11 @@
+import asyncio
 from uuid import uuid4
 
 import pytest
 from httpx import AsyncClient
 
+from src.api import sweep
+
 
 @pytest.mark.asyncio
 async def test_sweep_execution(client: AsyncClient):
@@ -91,3 +94,29 @@ async def test_sweep_execution(client: AsyncClient):
     # (10, 20) x (0, 90) -> 4 steps
     assert len(res["results"]) == 4
     assert len(res["headers"]) == 3  # Input V, Input A, Output Result
+
+
+@pytest.mark.asyncio
+async def test_failed_chunk_cancels_the_others(monkeypatch):
+    released = []
+    monkeypatch.setattr(sweep, "release_result", released.append)
+    interrupted = asyncio.Event()
+
+    async def done():
+        return {"success": True}
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("worker pool gone")
+
+    async def running():
+        try:
+            await asyncio.sleep(10)
+        finally:
+            interrupted.set()
+
+    with pytest.raises(RuntimeError):
+        await sweep.run_chunks([done(), failing(), running()])
+    # The slow chunk was interrupted, and the result that arrived was released
+    assert interrupted.is_set()
+    assert released == [{"success": True}]
@@ -0,0 +1,154 @@
+import ast
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from src.api.calculate import PreviewRequest, construct_sheet
+from src.core.calculation_service import _join_flight, calculation_key, run_cancellable
+from src.core.execution import prepared_handle
+from src.core.generator import CodeGenerator, _is_impure
+
+
+class FakeRequest:
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+@pytest.mark.asyncio
+async def test_newer_calculation_supersedes_older_one():
+    older = asyncio.ensure_future(run_cancellable(FakeRequest(), asyncio.sleep(10), "session"))
+    await asyncio.sleep(0.05)
+    newer = await run_cancellable(FakeRequest(), asyncio.sleep(0, result="done"), "session")
+    assert newer == "done"
+
+    with pytest.raises(HTTPException) as exc_info:
+        await older
+    assert exc_info.value.status_code == 409
+
+
+@pytest.mark.asyncio
+async def test_sessions_of_other_users_are_not_superseded():
+    release = asyncio.Event()
+
+    async def slow():
+        await release.wait()
+        return "alice"
+
+    first = asyncio.ensure_future(run_cancellable(FakeRequest(), slow(), "session", "alice"))
+    await asyncio.sleep(0)
+    # Same session id, different user
+    assert await run_cancellable(FakeRequest(), asyncio.sleep(0, result="bob"), "session", "bob") == "bob"
+    release.set()
+    assert await first == "alice"
+
+
+@pytest.mark.asyncio
+async def test_disconnect_cancels_calculation():
+    request = FakeRequest()
+    calculation = asyncio.ensure_future(asyncio.sleep(10))
+    pending = asyncio.ensure_future(run_cancellable(request, calculation))
+    await asyncio.sleep(0.05)
+    request.disconnected = True
+
+    with pytest.raises(HTTPException) as exc_info:
+        await pending
+    assert exc_info.value.status_code == 499
+    await asyncio.sleep(0)
+    assert calculation.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_identical_calculations_share_one_run():
+    runs = []
+
+    async def calculate():
+        runs.append(1)
+        await asyncio.sleep(0.1)
+        return {"results": {"n": len(runs)}}
+
+    first_db, second_db, third_db = object(), object(), object()
+    first = asyncio.ensure_future(_join_flight("key", calculate, first_db))
+    second = asyncio.ensure_future(_join_flight("key", calculate, second_db))
+    third = asyncio.ensure_future(_join_flight("key", calculate, third_db))
+    await asyncio.sleep(0.01)
+
+    # A viewer leaving does not cancel the run for the others
+    second.cancel()
+    assert await first == {"results": {"n": 1}}
+    assert await third == {"results": {"n": 1}}
+    assert len(runs) == 1
+
+    # Once it finished, the next calculation runs again
+    assert await _join_flight("key", calculate, first_db) == {"results": {"n": 2}}
+
+
+@pytest.mark.asyncio
+async def test_shared_run_is_cancelled_when_everyone_leaves():
+    started = asyncio.Event()
+
+    async def calculate():
+        started.set()
+        await asyncio.sleep(10)
+
+    waiters = [asyncio.ensure_future(_join_flight("abandoned", calculate, object())) for _ in range(2)]
+    await started.wait()
+    for waiter in waiters:
+        waiter.cancel()
+    await asyncio.gather(*waiters, return_exceptions=True)
+    await asyncio.sleep(0)
+
+    # A new request starts a fresh run instead of joining the cancelled one
+    started.clear()
+    fresh = asyncio.ensure_future(_join_flight("abandoned", calculate, object()))
+    await asyncio.wait_for(started.wait(), 1)
+    fresh.cancel()
+
+
+@pytest.mark.asyncio
+async def test_previews_of_the_same_graph_share_one_handle():
+    graph = {
+        "name": "Preview",
+        "nodes": [
+            {"type": "constant", "label": "x", "position_x": 0, "position_y": 0, "data": {"value": 2}},
+            {
+                "type": "function",
+                "label": "Double",
+                "position_x": 200,
+                "position_y": 0,
+                "data": {"code": "y = x * 2"},
+                "inputs": [{"key": "x"}],
+                "outputs": [{"key": "y"}],
+            },
+        ],
+    }
+
+    async def key(graph):
+        sheet = construct_sheet(PreviewRequest(graph=graph))
+        handle = prepared_handle(*await CodeGenerator(None).generate_prepared_sheet(sheet))
+        return calculation_key(handle, {}, sheet)
+
+    first = await key(graph)
+    assert await key(graph) == first
+    graph["nodes"][0]["data"]["value"] = 3
+    assert await key(graph) != first
+
+
+@pytest.mark.parametrize(
+    "code, impure",
+    [
+        ("y = np.sqrt(x)", False),
+        ("y = np.random.normal()", True),
+        ("from numpy.random import normal\ny = normal()", True),
+        ("from numpy import random as rnd\ny = rnd.normal()", True),
+        ("import numpy.random as rnd\ny = rnd.normal()", True),
+        ("y = getattr(np, 'random').normal()", True),
+        ("y = getattr(np, name)", True),
+        ("y = getattr(np, 'pi')", False),
+    ],
+)
+def test_function_nodes_using_randomness_are_impure(code, impure):
+    assert _is_impure(ast.parse(code)) is impure
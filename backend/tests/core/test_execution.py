@@ -0,0 +1,1003 @@
+import asyncio
+import linecache
+import math
+import os
+import time
+
+import numpy as np
+import pytest
+
+from src.core import execution
+from src.core.config import settings
+from src.core.exceptions import ExecutionOverloadedError, UnknownHandleError
+from src.core.execution import (
+    BATCH,
+    INTERACTIVE,
+    OUTPUTS_ONLY,
+    CodeCache,
+    LocalExecutor,
+    WorkerHandle,
+    WorkerPool,
+    _Job,
+    release_result,
+    render_pool_metrics,
+    split_blocks,
+    split_script,
+    trusted_versions_in,
+)
+
+SCRIPT = """import math
+
+class Model:
+    def area(self, r):
+        return math.pi * r * r
+
+# --- Execution Entry Point ---
+results = {"area": Model().area(REPLACE)}
+"""
+
+
+def test_split_script_keeps_line_numbers():
+    definitions, entry_point = split_script(SCRIPT.replace("REPLACE", "2"))
+    assert "class Model" in definitions
+    assert "Entry Point" not in definitions
+    assert entry_point.lstrip("\n").startswith("# --- Execution Entry Point ---")
+    # Entry point lines stay aligned with the original script
+    assert entry_point.count("\n") == SCRIPT.count("\n")
+
+
+def test_split_script_without_entry_point():
+    assert split_script("x = 1\n") == ("x = 1\n", "")
+
+
+def test_code_cache_lru():
+    cache = CodeCache(max_size=2)
+    first = cache.get_or_compile("a = 1\n")
+    assert cache.get_or_compile("a = 1\n") is first
+    cache.get_or_compile("b = 2\n")
+    cache.get_or_compile("c = 3\n")  # Evicts "a = 1"
+    cache.get_or_compile("a = 1\n")
+    assert cache.stats() == {"hits": 1, "misses": 4, "size": 2}
+
+
+def test_code_cache_keeps_source_of_retained_code():
+    cache = CodeCache(max_size=1)
+    code_obj = cache.get_or_compile("def fail():\n    raise ValueError('boom')\n")
+    cache.retain("handle", [code_obj])
+    cache.get_or_compile("b = 2\n")  # Evicts the code the prepared sheet still runs
+    assert linecache.getline(code_obj.co_filename, 2).strip() == "raise ValueError('boom')"
+    cache.release("handle")
+    assert linecache.getline(code_obj.co_filename, 2) == ""
+
+
+LIBRARY_BLOCK = """@sheet('library')
+class Library(SheetBase):
+    pass
+    def square(self, x):
+        return x * x
+"""
+
+
+VERSION_ID = "0b6c1f9e-2d4a-4c8e-9f1a-6f2b7c3d8e10"
+VERSIONED_BLOCK = f"""@sheet('library')  # version {VERSION_ID} generator 1
+class Library_v1(SheetBase):
+    pass
+"""
+
+
+def test_code_cache_persists_versioned_blocks(tmp_path):
+    cache = CodeCache(max_size=4, directory=str(tmp_path))
+    code_obj = cache.get_or_compile(VERSIONED_BLOCK)
+    cache.get_or_compile(LIBRARY_BLOCK)  # Drafts can change, so they stay in memory only
+    files = list(tmp_path.rglob("*.bin"))
+    assert len(files) == 1
+    assert files[0].name.startswith(f"{VERSION_ID}-g1-")
+
+    # A fresh worker loads the block instead of compiling it
+    restarted = CodeCache(max_size=4, directory=str(tmp_path))
+    loaded = restarted.get_or_compile(VERSIONED_BLOCK)
+    assert loaded.co_code == code_obj.co_code
+    assert loaded.co_filename == code_obj.co_filename
+    assert restarted.stats() == {"hits": 0, "misses": 1, "size": 1, "disk_hits": 1}
+
+
+def test_code_cache_ignores_corrupt_bytecode(tmp_path):
+    CodeCache(max_size=4, directory=str(tmp_path)).get_or_compile(VERSIONED_BLOCK)
+    (path,) = tmp_path.rglob("*.bin")
+    path.write_bytes(b"not marshal")
+
+    cache = CodeCache(max_size=4, directory=str(tmp_path))
+    assert cache.get_or_compile(VERSIONED_BLOCK) is not None
+    assert cache.stats()["disk_hits"] == 0
+
+
+TRUSTED_BLOCK = (
+    VERSIONED_BLOCK
+    + """    def total(self, values):
+        total = 0
+        for value in values:
+            total += value.real
+        return total
+"""
+)
+
+
+def test_code_cache_compiles_trusted_versions_without_guards(tmp_path):
+    trusted = CodeCache(max_size=4, directory=str(tmp_path), trusted_versions=frozenset({VERSION_ID}))
+    # Neither _getattr_, _getiter_ nor _inplacevar_ is defined
+    namespace = {"sheet": lambda sheet_id: lambda cls: cls, "SheetBase": object, "__metaclass__": type}
+    exec(trusted.get_or_compile(TRUSTED_BLOCK), namespace)
+    assert namespace["Library_v1"]().total([1, 2.5]) == 3.5
+
+    restricted = CodeCache(max_size=4, directory=str(tmp_path))
+    namespace = {"sheet": lambda sheet_id: lambda cls: cls, "SheetBase": object, "__metaclass__": type}
+    exec(restricted.get_or_compile(TRUSTED_BLOCK), namespace)
+    with pytest.raises(NameError):
+        namespace["Library_v1"]().total([1, 2.5])
+    # The restricted worker did not pick up the unguarded bytecode
+    assert restricted.stats()["disk_hits"] == 0
+    assert len(list(tmp_path.rglob("trusted/*.bin"))) == 1
+
+
+def test_trusted_versions_are_routed_by_setting(monkeypatch):
+    definitions = "import math\n\n" + TRUSTED_BLOCK + "\n\n@sheet('root')\nclass Root(SheetBase):\n    pass\n"
+    monkeypatch.setattr(settings, "TRUSTED_SHEET_VERSIONS", set())
+    assert trusted_versions_in(definitions) == set()
+    monkeypatch.setattr(settings, "TRUSTED_SHEET_VERSIONS", {VERSION_ID.upper()})
+    assert trusted_versions_in(definitions) == {VERSION_ID}
+
+
+@pytest.fixture
+def local_executor(monkeypatch):
+    """A LocalExecutor whose pools are started by the test and shut down after it."""
+    monkeypatch.setattr(execution, "_worker_pool", None)
+    monkeypatch.setattr(execution, "_trusted_worker_pool", None)
+    executor = LocalExecutor()
+    yield executor
+    executor.shutdown()
+
+
+TRUSTED_PRINTING_SCRIPT = f"""@sheet('library')  # version {VERSION_ID} generator 1
+class Library_v1(SheetBase):
+    pass
+
+    @function_node('shout', inputs={{}})
+    def shout(self):
+        print('trusted', type(self).__name__)
+        return next(iter([getattr(self, 'missing', 1)]))
+
+# --- Execution Entry Point ---
+sheet_instance = Library_v1()
+sheet_instance.run()
+"""
+
+
+@pytest.mark.asyncio
+async def test_trusted_nodes_print_in_the_trusted_pool(monkeypatch, local_executor):
+    monkeypatch.setattr(settings, "TRUSTED_SHEET_VERSIONS", {VERSION_ID})
+    monkeypatch.setattr(settings, "TRUSTED_WORKER_COUNT", 1)
+    monkeypatch.setattr(settings, "WORKER_STANDBY_COUNT", 0)
+    monkeypatch.setattr(settings, "WORKER_STDOUT_LIMIT_BYTES", 100)
+    result = await local_executor.execute(TRUSTED_PRINTING_SCRIPT, timeout=10.0)
+    assert result["success"], result.get("error")
+    shout = result["results"]["shout"]
+    assert shout["value"] == 1
+    assert shout["stdout"] == "trusted Library_v1\n"
+    # Only the trusted pool was started
+    assert execution._worker_pool is None
+    assert execution._trusted_worker_pool is not None
+
+
+def test_split_blocks_is_independent_of_position():
+    header = "import math\n\n"
+    first = header + LIBRARY_BLOCK + "\n\n@sheet('a')\nclass A(SheetBase):\n    pass"
+    second = header + "@sheet('b')\nclass B(SheetBase):\n    pass\n\n" + LIBRARY_BLOCK
+
+    first_blocks, second_blocks = split_blocks(first), split_blocks(second)
+    assert len(first_blocks) == len(second_blocks) == 3
+    assert first_blocks[0] == second_blocks[0] == "import math\n"
+    assert first_blocks[1] == second_blocks[2] == LIBRARY_BLOCK
+
+
+@pytest.mark.asyncio
+async def test_shared_sheet_classes_are_compiled_once():
+    worker = WorkerHandle(0)
+    try:
+        for name in ("A", "B"):
+            definitions = f"{LIBRARY_BLOCK}\n\n@sheet('{name}')\nclass {name}(SheetBase):\n    pass\n"
+            script = definitions + "\n# --- Execution Entry Point ---\nresults = {'x': Library.square(None, 3)}\n"
+            result = await worker.execute({"script": script}, timeout=10.0)
+            assert result["success"], result.get("error")
+            assert result["results"] == {"x": 9}
+        # The second script only compiled its own class
+        assert worker.code_cache_stats["misses"] == 3
+        assert worker.code_cache_stats["hits"] == 1
+    finally:
+        worker.kill()
+
+
+@pytest.mark.asyncio
+async def test_worker_reuses_compiled_definitions():
+    worker = WorkerHandle(0)
+    try:
+        for radius in (1, 2, 3):
+            result = await worker.execute({"script": SCRIPT.replace("REPLACE", str(radius))}, timeout=10.0)
+            assert result["success"], result.get("error")
+            assert result["results"]["area"] == pytest.approx(math.pi * radius * radius)
+        assert worker.code_cache_stats["misses"] == 1
+        assert worker.code_cache_stats["hits"] == 2
+    finally:
+        worker.kill()
+
+
+PREPARED_DEFINITIONS = """import math
+
+class Model:
+    def area(self, r):
+        return math.pi * r * r
+"""
+PREPARED_ENTRY_POINT = """
+# --- Execution Entry Point ---
+results = {"area": Model().area(input_overrides["r"])}
+"""
+
+
+@pytest.mark.asyncio
+async def test_prepared_sheet_only_ships_overrides():
+    pool = WorkerPool(1)
+    worker = pool.workers[0]
+    try:
+        handle = pool.prepare(PREPARED_DEFINITIONS, PREPARED_ENTRY_POINT)
+        assert pool.prepare(PREPARED_DEFINITIONS, PREPARED_ENTRY_POINT) == handle
+
+        for radius in (1, 2):
+            result = await pool.execute_prepared(handle, {"r": radius}, timeout=10.0)
+            assert result["success"], result.get("error")
+            assert result["results"]["area"] == pytest.approx(math.pi * radius * radius)
+        assert handle in worker.prepared_handles
+        # Definitions and entry point were compiled once, on the first run
+        assert worker.code_cache_stats["misses"] == 2
+
+        # A recycled worker is transparently prepared again
+        worker.stop()
+        result = await pool.execute_prepared(handle, {"r": 3}, timeout=10.0)
+        assert result["success"], result.get("error")
+        assert result["results"]["area"] == pytest.approx(math.pi * 9)
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_same_sheet_sticks_to_one_worker():
+    pool = WorkerPool(3)
+    try:
+        for _ in range(4):
+            result = await pool.execute("results = {}", timeout=10.0, affinity="sheet-a")
+            assert result["success"], result.get("error")
+        assert sorted(w.tasks_completed for w in pool.workers) == [0, 0, 4]
+
+        # A busy preferred worker overflows to another one instead of queueing
+        sleep = SLEEP_SCRIPT.replace("DURATION", "0.5")
+        results = await asyncio.gather(*(pool.execute(sleep, timeout=10.0, affinity="sheet-a") for _ in range(2)))
+        assert all(result["success"] for result in results)
+
+        stats = pool.stats()
+        assert stats["affinity"] == {"preferred": 5, "overflow": 1}
+        assert all("code_cache_hit_rate" in w and "prepared_hit_rate" in w for w in stats["per_worker"])
+
+        # The same counters are served on /metrics
+        lines = render_pool_metrics([({"pool": "default"}, stats)])
+        assert 'parascope_pool_affinity_preferred_total{pool="default"} 5' in lines
+        assert 'parascope_pool_affinity_overflow_total{pool="default"} 1' in lines
+        busiest = max(pool.workers, key=lambda w: w.tasks_completed)
+        assert f'parascope_worker_tasks_total{{pool="default",worker="{busiest.index}"}} 5' in lines
+        assert any(line.startswith("parascope_worker_code_cache_hit_rate{") for line in lines)
+    finally:
+        pool.shutdown()
+
+
+PRINTING_SCRIPT = """@sheet('printing')
+class Printing(SheetBase):
+    pass
+
+    @function_node('loud', inputs={})
+    def loud(self):
+        for i in range(10000):
+            print('line', i)
+        return 1
+
+    @function_node('quiet', inputs={})
+    def quiet(self):
+        print('hello')
+        return 2
+
+# --- Execution Entry Point ---
+sheet_instance = Printing()
+sheet_instance.run()
+"""
+
+
+@pytest.mark.asyncio
+async def test_printed_output_is_bounded_per_node(monkeypatch):
+    monkeypatch.setattr(settings, "WORKER_STDOUT_LIMIT_BYTES", 100)
+    worker = WorkerHandle(0)
+    try:
+        for _ in range(2):
+            result = await worker.execute({"script": PRINTING_SCRIPT}, timeout=10.0)
+            assert result["success"], result.get("error")
+            results = result["results"]
+            # Output does not carry over between nodes or tasks
+            assert results["quiet"]["stdout"] == "hello\n"
+            loud = results["loud"]["stdout"]
+            assert loud.startswith("line 0\nline 1\n")
+            assert loud.endswith("[output truncated at 100 bytes]\n")
+            assert len(loud) < 200
+            assert "stdout" not in result
+    finally:
+        worker.kill()
+
+
+NESTED_SCRIPT = """@sheet('inner')
+class Inner(SheetBase):
+    pass
+
+    @input_node('inner_x', label='x', value=2)
+    def x(self):
+        pass
+
+    @function_node('inner_double', inputs={'v': 'x'})
+    def double(self, v):
+        return v * 2
+
+    @output_node('inner_out', inputs={'value': 'double'}, label='out')
+    def out(self, value):
+        pass
+
+@sheet('outer')
+class Outer(SheetBase):
+    pass
+
+    @sheet_node('outer_sub', inputs={})
+    def sub(self):
+        instance = Inner()
+        self.register_instance('outer_sub', instance)
+        return instance.run()
+
+    @function_node('outer_mid', inputs={'v': 'sub'})
+    def mid(self, v):
+        return v['out'] + 1
+
+    @output_node('outer_out', inputs={'value': 'mid'}, label='result')
+    def result(self, value):
+        pass
+
+# --- Execution Entry Point ---
+sheet_instance = Outer()
+sheet_instance.run()
+"""
+
+
+@pytest.mark.asyncio
+async def test_result_projection():
+    pool = WorkerPool(1)
+    try:
+        result = await pool.execute(NESTED_SCRIPT, timeout=10.0)
+        assert result["success"], result.get("error")
+        assert set(result["results"]) == {"outer_sub", "outer_mid", "outer_out"}
+        assert set(result["results"]["outer_sub"]["nodes"]) == {"inner_x", "inner_double", "inner_out"}
+
+        result = await pool.execute(NESTED_SCRIPT, timeout=10.0, projection=OUTPUTS_ONLY)
+        assert result["results"] == {"outer_out": {"value": 5, "is_computable": True}}
+
+        # Selected nested nodes keep the path to them, without the sheet node's own result
+        result = await pool.execute(NESTED_SCRIPT, timeout=10.0, projection={"inner_double", "outer_mid"})
+        assert result["results"] == {
+            "outer_sub": {"nodes": {"inner_double": {"value": 4, "is_computable": True}}},
+            "outer_mid": {"value": 5, "is_computable": True},
+        }
+
+        with pytest.raises(ValueError):
+            await pool.execute(NESTED_SCRIPT, timeout=10.0, projection="everything")
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_profile_covers_nested_nodes():
+    worker = WorkerHandle(0)
+    try:
+        result = await worker.execute({"script": NESTED_SCRIPT, "profile": True}, timeout=10.0)
+        assert result["success"], result.get("error")
+        sub = result["results"]["outer_sub"]
+        inner = sub["nodes"]["inner_double"]["profile"]
+        assert set(inner) == {"wall_seconds", "cpu_seconds", "peak_bytes"}
+        # The sheet node includes the time of the nodes inside it
+        assert sub["profile"]["wall_seconds"] >= inner["wall_seconds"]
+
+        result = await worker.execute({"script": NESTED_SCRIPT}, timeout=10.0)
+        assert "profile" not in result["results"]["outer_sub"]
+    finally:
+        worker.kill()
+
+
+MEMO_SCRIPT = """@sheet('memo')
+class Memo(SheetBase):
+    pass
+
+    @input_node('memo_x', label='x', value=REPLACE)
+    def x(self):
+        pass
+
+    @function_node('memo_pure', inputs={'v': 'x'}, code_hash='abc')
+    def pure(self, v):
+        return {'y': [v, v]}
+
+    @function_node('memo_impure', inputs={'v': 'x'})
+    def impure(self, v):
+        return {'y': v}
+
+# --- Execution Entry Point ---
+sheet_instance = Memo()
+sheet_instance.run()
+"""
+
+
+@pytest.mark.asyncio
+async def test_pure_function_nodes_are_memoized(monkeypatch):
+    monkeypatch.setattr(settings, "WORKER_NODE_MEMO_MB", 1)
+    worker = WorkerHandle(0)
+    try:
+        cached = []
+        for value in (1, 1, 2):
+            result = await worker.execute({"script": MEMO_SCRIPT.replace("REPLACE", str(value))}, timeout=10.0)
+            assert result["success"], result.get("error")
+            results = result["results"]
+            assert results["memo_pure"]["value"] == {"y": [value, value]}
+            assert "cached" not in results["memo_impure"]
+            cached.append(results["memo_pure"].get("cached", False))
+        assert cached == [False, True, False]
+        assert worker.node_memo_stats["hits"] == 1
+        assert worker.node_memo_stats["misses"] == 2
+    finally:
+        worker.kill()
+
+
+def test_sheet_code_cannot_reach_the_node_memo():
+    # The memo is shared by every sheet the worker runs
+    block = MEMO_SCRIPT.replace("return {'y': v}", "return {'y': self._node_memo}")
+    with pytest.raises(SyntaxError, match="_node_memo"):
+        CodeCache(max_size=4).get_or_compile(split_script(block)[0])
+
+
+@pytest.mark.asyncio
+async def test_results_carry_phase_timings():
+    pool = WorkerPool(1)
+    try:
+        result = await pool.execute(SCRIPT.replace("REPLACE", "1"), timeout=10.0)
+        assert result["success"], result.get("error")
+        timings = result["timings"]
+        assert set(timings) >= {"queue_wait", "compile", "exec", "extract", "worker", "transfer", "deserialize"}
+        assert timings["worker"] >= timings["compile"] + timings["exec"]
+        assert "shared_memory" not in timings
+
+        result = await pool.execute("while True: pass", timeout=0.5)
+        assert result["error"] == "Execution timed out"
+        assert "queue_wait" in result["timings"]
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_unknown_prepared_handle():
+    pool = WorkerPool(1)
+    try:
+        with pytest.raises(UnknownHandleError):
+            await pool.execute_prepared("missing", {}, timeout=1.0)
+    finally:
+        pool.shutdown()
+
+
+SLEEP_SCRIPT = """import time
+time.sleep(DURATION)
+results = {"slept": DURATION}
+"""
+
+
+@pytest.mark.asyncio
+async def test_idle_worker_takes_next_job():
+    pool = WorkerPool(2)
+    try:
+        # Warm up both workers so process start-up does not skew the timings
+        await asyncio.gather(*(pool.execute("results = {}", timeout=10.0) for _ in range(2)))
+
+        async def run(duration):
+            start = time.monotonic()
+            result = await pool.execute(SLEEP_SCRIPT.replace("DURATION", str(duration)), timeout=10.0)
+            assert result["success"], result.get("error")
+            return time.monotonic() - start
+
+        # Round-robin would queue the third job behind the slow first one
+        slow, fast, next_fast = await asyncio.gather(run(2), run(0), run(0))
+        assert slow >= 2
+        assert next_fast < 1.5
+
+        stats = pool.stats()
+        assert stats["queue_depth"] == 0
+        assert stats["in_flight"] == 0
+        assert sum(w["tasks_completed"] for w in stats["per_worker"]) == 5
+    finally:
+        pool.shutdown()
+
+
+class FakeClock:
+    """Stands in for time.monotonic, so scheduling decisions do not depend on how fast the machine is."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class HeldJob:
+    """A job that occupies a worker, without running anything, until the test releases it."""
+
+    def __init__(self, pool, name, lane, finished):
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+        async def run(worker):
+            self.started.set()
+            await self.release.wait()
+            finished.append(name)
+            return {"success": True, "worker": worker.index}
+
+        self.future = asyncio.ensure_future(pool._submit(_Job(run, lane=lane)))
+
+
+class HeldJobs:
+    def __init__(self, pool):
+        self.pool = pool
+        self.finished = []  # Names of the jobs in the order they completed
+
+    def submit(self, name="", lane=INTERACTIVE):
+        return HeldJob(self.pool, name, lane, self.finished)
+
+    async def release(self, *held):
+        for job in held:
+            job.release.set()
+        return await asyncio.gather(*(job.future for job in held))
+
+    async def run(self):
+        return (await self.release(self.submit()))[0]
+
+
+def fire_reap(pool):
+    """Runs the idle check now instead of when its timer is due."""
+    if pool._reap_timer is not None:
+        pool._reap_timer.cancel()
+    pool._reap_idle_workers()
+
+
+@pytest.mark.asyncio
+async def test_batch_work_leaves_reserved_workers_to_interactive(monkeypatch):
+    monkeypatch.setattr(settings, "WORKER_INTERACTIVE_RESERVED", 1)
+    monkeypatch.setattr(settings, "WORKER_STANDBY_COUNT", 0)
+    pool = WorkerPool(2)
+    jobs = HeldJobs(pool)
+    try:
+        batch = [jobs.submit(f"batch-{i}", BATCH) for i in range(2)]
+        await asyncio.sleep(0)
+        assert pool.stats()["lanes"]["batch"] == {"queued": 1, "in_flight": 1}
+
+        # The reserved worker is free for interactive work
+        interactive = jobs.submit("interactive")
+        await asyncio.sleep(0)
+        assert pool.stats()["lanes"] == {
+            "interactive": {"queued": 0, "in_flight": 1},
+            "batch": {"queued": 1, "in_flight": 1},
+        }
+        assert (await jobs.release(interactive))[0]["success"]
+        # Even with the reserved worker idle, the second batch job waits for the first
+        assert pool.stats()["lanes"]["batch"] == {"queued": 1, "in_flight": 1}
+
+        assert all(r["success"] for r in await jobs.release(*batch))
+        assert jobs.finished == ["interactive", "batch-0", "batch-1"]
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_interactive_work_goes_ahead_of_queued_batch_work(monkeypatch):
+    monkeypatch.setattr(settings, "WORKER_STANDBY_COUNT", 0)
+    pool = WorkerPool(1)
+    jobs = HeldJobs(pool)
+    try:
+        # A single worker still serves batch work, one chunk at a time
+        held = [jobs.submit(f"batch-{i}", BATCH) for i in range(3)]
+        await asyncio.sleep(0)
+        held.append(jobs.submit("interactive"))
+        await asyncio.sleep(0)
+        await jobs.release(*held)
+        assert jobs.finished == ["batch-0", "interactive", "batch-1", "batch-2"]
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_overload_is_rejected_with_a_retry_estimate(monkeypatch):
+    monkeypatch.setattr(settings, "WORKER_MAX_QUEUE_DEPTH", 1)
+    monkeypatch.setattr(settings, "WORKER_MAX_QUEUE_WAIT_SECONDS", 0)
+    monkeypatch.setattr(settings, "WORKER_STANDBY_COUNT", 0)
+    clock = FakeClock()
+    pool = WorkerPool(1, clock=clock)
+    jobs = HeldJobs(pool)
+    try:
+        first = jobs.submit()
+        await first.started.wait()
+        clock.advance(0.5)
+        await jobs.release(first)
+        assert list(pool.service_times[INTERACTIVE]) == [0.5]
+
+        held = [jobs.submit("running"), jobs.submit("queued")]
+        await asyncio.sleep(0)
+        with pytest.raises(ExecutionOverloadedError) as exc_info:
+            await pool.execute("results = {}", timeout=10.0)
+        # Two jobs ahead of it, half a second each
+        assert exc_info.value.retry_after == pytest.approx(1.0)
+
+        # Batch work is not subject to admission control
+        held.append(jobs.submit("batch", BATCH))
+        assert all(r["success"] for r in await jobs.release(*held))
+        assert pool.stats()["rejected"] == 1
+
+        # With the queue drained, work is admitted again
+        monkeypatch.setattr(settings, "WORKER_MAX_QUEUE_WAIT_SECONDS", 0.1)
+        assert (await pool.execute("results = {}", timeout=10.0))["success"]
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_admission_counts_workers_the_pool_can_add(monkeypatch):
+    monkeypatch.setattr(settings, "WORKER_MAX_QUEUE_WAIT_SECONDS", 0.6)
+    monkeypatch.setattr(settings, "WORKER_SCALE_UP_QUEUE_DEPTH", 10)
+    monkeypatch.setattr(settings, "WORKER_SCALE_UP_WAIT_SECONDS", 1)
+    monkeypatch.setattr(settings, "WORKER_STANDBY_COUNT", 0)
+    clock = FakeClock()
+    pool = WorkerPool(1, min_count=1, max_count=3, clock=clock)
+    try:
+        # Waiting for a cold process to start is not part of the service time
+        async def cold_start(worker):
+            clock.advance(2.5)
+            worker.startup_wait = 2.0
+            return {"success": True}
+
+        await pool._submit(_Job(cold_start))
+        assert list(pool.service_times[INTERACTIVE]) == [0.5]
+
+        # One worker alone would take a second to get to the third job; three take a third of that
+        jobs = HeldJobs(pool)
+        held = [jobs.submit() for _ in range(3)]
+        await asyncio.sleep(0)
+        assert pool.stats()["rejected"] == 0
+        assert len(pool.workers) == 1
+
+        # The queued jobs have waited long enough to add the workers they were admitted on
+        clock.advance(1)
+        pool._dispatch()
+        assert len(pool.workers) == 3
+        assert all(r["success"] for r in await jobs.release(*held))
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_large_messages_cross_the_pipe():
+    worker = WorkerHandle(0)
+    try:
+        payload = "x" * (4 * 1024 * 1024)
+        script = f"results = {{'echo': {payload!r}, 'size': len({payload!r})}}"
+        result = await worker.execute({"script": script}, timeout=30.0)
+        assert result["success"], result.get("error")
+        assert result["results"]["size"] == len(payload)
+        assert result["results"]["echo"] == payload
+    finally:
+        worker.kill()
+
+
+@pytest.mark.asyncio
+async def test_large_arrays_travel_through_shared_memory(monkeypatch):
+    monkeypatch.setattr(settings, "SHARED_MEMORY_THRESHOLD_BYTES", 1024)
+    worker = WorkerHandle(0)
+    try:
+        script = "import numpy\nresults = {'big': [numpy.arange(100000.0)], 'small': numpy.arange(3.0)}"
+        result = await worker.execute({"script": script}, timeout=10.0)
+        assert result["success"], result.get("error")
+        assert len(result["shared_memory"]) == 1
+        big = result["results"]["big"][0]
+        assert big.shape == (100000,)
+        assert big[-1] == 99999.0
+        np.testing.assert_array_equal(result["results"]["small"], np.arange(3.0))
+        del big
+
+        release_result(result)
+        assert "shared_memory" not in result
+        assert "results" not in result
+    finally:
+        worker.kill()
+
+
+@pytest.mark.asyncio
+async def test_worker_crash_is_detected_without_waiting_for_timeout():
+    worker = WorkerHandle(0)
+    try:
+        await worker.execute({"script": "results = {}"}, timeout=10.0)
+        process = worker.process.process
+        asyncio.get_running_loop().call_later(0.5, process.kill)
+
+        start = time.monotonic()
+        result = await worker.execute({"script": SLEEP_SCRIPT.replace("DURATION", "5")}, timeout=10.0)
+        assert not result["success"]
+        assert "exited unexpectedly" in result["error"]
+        assert time.monotonic() - start < 3
+
+        # The slot recovers with a fresh process
+        result = await worker.execute({"script": "results = {'ok': True}"}, timeout=10.0)
+        assert result["results"] == {"ok": True}
+    finally:
+        worker.kill()
+
+
+@pytest.mark.asyncio
+async def test_pool_scales_with_queue_and_reaps_idle_workers(monkeypatch):
+    monkeypatch.setattr(settings, "WORKER_SCALE_UP_QUEUE_DEPTH", 2)
+    monkeypatch.setattr(settings, "WORKER_SCALE_UP_WAIT_SECONDS", 1)
+    # Far longer than the test takes, so only fire_reap retires workers
+    monkeypatch.setattr(settings, "WORKER_IDLE_TIMEOUT_SECONDS", 60)
+    monkeypatch.setattr(settings, "WORKER_STANDBY_COUNT", 0)
+    clock = FakeClock()
+    pool = WorkerPool(1, min_count=1, max_count=3, clock=clock)
+    jobs = HeldJobs(pool)
+    try:
+        held = [jobs.submit(str(i)) for i in range(4)]
+        await asyncio.sleep(0)
+        assert len(pool.workers) == 3
+        assert pool.stats()["scale_ups"] == 2
+        assert pool.stats()["queue_depth"] == 1
+
+        clock.advance(1)
+        assert all(r["success"] for r in await jobs.release(*held))
+
+        # Workers above the minimum are retired once the idle cooldown is over
+        clock.advance(59)
+        fire_reap(pool)
+        assert len(pool.workers) == 3
+        clock.advance(1)
+        fire_reap(pool)
+        stats = pool.stats()
+        assert stats["workers"] == 1
+        assert stats["scale_downs"] == 2
+        assert [e["action"] for e in stats["scale_events"]] == ["scale_up", "scale_up", "scale_down", "scale_down"]
+
+        # A single waiting job adds a worker once it has waited long enough
+        held = [jobs.submit(), jobs.submit()]
+        await asyncio.sleep(0)
+        assert len(pool.workers) == 1
+        clock.advance(1)
+        pool._dispatch()
+        assert len(pool.workers) == 2
+        assert pool.stats()["scale_events"][-1]["reason"].startswith("queue wait")
+        await jobs.release(*held)
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_surplus_workers_are_reaped_under_a_trickle_of_jobs(monkeypatch):
+    monkeypatch.setattr(settings, "WORKER_SCALE_UP_QUEUE_DEPTH", 1)
+    monkeypatch.setattr(settings, "WORKER_IDLE_TIMEOUT_SECONDS", 60)
+    monkeypatch.setattr(settings, "WORKER_STANDBY_COUNT", 0)
+    clock = FakeClock()
+    pool = WorkerPool(1, min_count=1, max_count=2, clock=clock)
+    jobs = HeldJobs(pool)
+    try:
+        held = [jobs.submit() for _ in range(2)]
+        await asyncio.sleep(0)
+        assert len(pool.workers) == 2
+        await jobs.release(*held)
+        reap_due = pool._reap_timer.when()
+
+        # One worker keeps up with a job every 10s; the other must still go once its cooldown is over
+        workers = set()
+        for _ in range(6):
+            clock.advance(10)
+            workers.add((await jobs.run())["worker"])
+        assert len(workers) == 1
+        # Finished jobs did not postpone the check
+        assert pool._reap_timer.when() == reap_due
+        clock.advance(1)
+        fire_reap(pool)
+        assert [w.index for w in pool.workers] == list(workers)
+        assert pool.stats()["scale_downs"] == 1
+
+        lines = render_pool_metrics([({"pool": "default"}, pool.stats())])
+        assert 'parascope_pool_scale_ups_total{pool="default"} 1' in lines
+        assert 'parascope_pool_scale_downs_total{pool="default"} 1' in lines
+        assert 'parascope_pool_workers{pool="default"} 1' in lines
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_timed_out_worker_is_replaced_by_warm_standby(monkeypatch):
+    monkeypatch.setattr(settings, "WORKER_STANDBY_COUNT", 1)
+    pool = WorkerPool(1)
+    try:
+        await pool.execute("results = {}", timeout=10.0)
+        spare = pool.standby[0]
+        await asyncio.wait_for(spare.ready_task, 10.0)
+        assert spare.ready
+
+        result = await pool.execute("while True: pass", timeout=0.5)
+        assert result["error"] == "Execution timed out"
+        # The spare was swapped in right away and a new spare is being built
+        assert pool.workers[0].process is spare
+        assert pool.stats()["standby_swaps"] == 1
+        assert len(pool.standby) == 1 and pool.standby[0] is not spare
+
+        start = time.monotonic()
+        result = await pool.execute("results = {'ok': True}", timeout=10.0)
+        assert result["results"] == {"ok": True}
+        assert time.monotonic() - start < 0.5
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_spare_still_starting_is_swapped_in(monkeypatch):
+    monkeypatch.setattr(settings, "WORKER_STANDBY_COUNT", 1)
+    pool = WorkerPool(1)
+    try:
+        # Let the spare start waiting for its start-up handshake
+        spare = pool.standby[0]
+        await asyncio.sleep(0)
+        assert not spare.ready
+
+        # The worker is replaced while the spare is still loading, and used right away
+        worker = pool.workers[0]
+        worker.replace()
+        assert worker.process is spare
+        result = await worker.execute({"script": "results = {'ok': True}"}, timeout=5.0)
+        assert result["success"], result.get("error")
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_calculations_release_their_worker(monkeypatch):
+    monkeypatch.setattr(settings, "WORKER_STANDBY_COUNT", 1)
+    pool = WorkerPool(1)
+    try:
+        await pool.execute("results = {}", timeout=10.0)
+        spare = pool.standby[0]
+        await asyncio.wait_for(spare.ready_task, 10.0)
+
+        running = asyncio.ensure_future(pool.execute("while True: pass", timeout=30.0))
+        queued = asyncio.ensure_future(pool.execute("results = {'stale': True}", timeout=30.0))
+        await asyncio.sleep(0.2)
+        assert len(pool.pending) == 1
+
+        # Queued work is dropped, running work is interrupted by swapping in the spare
+        queued.cancel()
+        running.cancel()
+        await asyncio.gather(running, queued, return_exceptions=True)
+        await asyncio.sleep(0.1)
+        assert not pool.pending
+        assert pool.workers[0].process is spare
+
+        start = time.monotonic()
+        result = await pool.execute("results = {'ok': True}", timeout=10.0)
+        assert result["results"] == {"ok": True}
+        assert time.monotonic() - start < 0.5
+        assert pool.stats()["per_worker"][0]["tasks_completed"] == 3
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_forkserver_workers_start_from_template():
+    if settings.WORKER_START_METHOD != "forkserver":
+        pytest.skip("Workers are not started through the forkserver")
+    worker = WorkerHandle(0)
+    try:
+        script = "import scipy.optimize\nresults = {'root': scipy.optimize.brentq(lambda x: x - 2, 0, 5)}"
+        result = await worker.execute({"script": script}, timeout=30.0)
+        assert result["success"], result.get("error")
+        assert result["results"]["root"] == pytest.approx(2)
+        assert type(worker.process.process._popen).__module__ == "multiprocessing.popen_forkserver"
+
+        # Respawning forks the already-loaded template instead of importing everything again
+        start = time.monotonic()
+        worker.replace()
+        await asyncio.wait_for(worker.process.wait_ready(), 10.0)
+        assert time.monotonic() - start < 1
+    finally:
+        worker.kill()
+
+
+@pytest.mark.asyncio
+async def test_workers_are_pinned_to_disjoint_cpus(monkeypatch):
+    if not hasattr(os, "sched_setaffinity") or len(os.sched_getaffinity(0)) < 2:
+        pytest.skip("CPU affinity needs Linux and at least two CPUs")
+    monkeypatch.setattr(settings, "WORKER_CPU_AFFINITY", True)
+    pool = WorkerPool(2, min_count=2, max_count=2)
+    try:
+        first, second = pool.workers
+        assert first.cpus and second.cpus and not first.cpus & second.cpus
+        assert os.sched_getaffinity(first.process.pid) == first.cpus
+
+        # A replacement process is pinned like the one it replaces
+        first.replace()
+        assert os.sched_getaffinity(first.process.pid) == first.cpus
+        result = await pool.execute("results = {'ok': True}", timeout=10.0)
+        assert result["results"] == {"ok": True}
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_worker_blas_threads_are_capped(monkeypatch):
+    if settings.WORKER_START_METHOD == "fork" or not os.path.exists("/proc/self/environ"):
+        pytest.skip("Forked workers inherit the parent's environment")
+    monkeypatch.setattr(settings, "WORKER_NUM_THREADS", 1)
+    worker = WorkerHandle(0)
+    try:
+        await worker.execute({"script": "results = {}"}, timeout=10.0)
+        with open(f"/proc/{worker.process.pid}/environ", "rb") as f:
+            environment = f.read().split(b"\0")
+        assert b"OPENBLAS_NUM_THREADS=1" in environment
+        assert b"OMP_NUM_THREADS=1" in environment
+    finally:
+        worker.kill()
+
+
+@pytest.mark.asyncio
+async def test_worker_is_recycled_after_task_limit(monkeypatch):
+    monkeypatch.setattr(settings, "WORKER_STANDBY_COUNT", 1)
+    monkeypatch.setattr(settings, "WORKER_MAX_TASKS", 2)
+    pool = WorkerPool(1)
+    worker = pool.workers[0]
+    try:
+        first_process = worker.process
+        for _ in range(2):
+            result = await pool.execute("results = {'ok': True}", timeout=10.0)
+            assert result["results"] == {"ok": True}
+        # Recycled right after the second task, using the warm spare
+        assert worker.process is not first_process
+        assert worker.process_tasks == 0
+        assert pool.stats()["recycles"] == 1
+        assert pool.stats()["standby_swaps"] == 1
+
+        result = await pool.execute("results = {'ok': True}", timeout=10.0)
+        assert result["results"] == {"ok": True}
+        assert worker.process_tasks == 1
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_worker_reports_memory_and_is_recycled_over_limit(monkeypatch):
+    monkeypatch.setattr(settings, "WORKER_MAX_RSS_MB", 1)
+    worker = WorkerHandle(0)
+    try:
+        first_process = worker.process
+        result = await worker.execute({"script": "results = {}"}, timeout=10.0)
+        assert result["success"]
+        assert worker.recycles == 1
+        assert worker.process is not first_process
+    finally:
+        worker.kill()
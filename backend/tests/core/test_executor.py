@@ -0,0 +1,147 @@
+import os
+import socket
+import tempfile
+
+import pytest
+
+from src.core import execution
+from src.core.config import settings
+from src.core.exceptions import ExecutorUnavailableError
+from src.core.execution import LocalExecutor, split_script
+from src.core.executor import ExecutorClient, ExecutorRegistry, ExecutorServer
+
+SCRIPT = """import math
+
+class Model:
+    def area(self, r):
+        return math.pi * r * r
+
+# --- Execution Entry Point ---
+results = {"area": Model().area(input_overrides.get("r", 2) if "input_overrides" in globals() else 2)}
+"""
+
+
+@pytest.fixture
+def socket_path():
+    # Unix socket paths are limited to about 100 characters, which pytest's tmp_path may exceed
+    directory = tempfile.mkdtemp(prefix="parascope-")
+    yield os.path.join(directory, "executor.sock")
+    os.rmdir(directory)
+
+
+@pytest.fixture
+def local_executor(monkeypatch):
+    """A LocalExecutor whose pools are started by the test, not left behind by earlier ones."""
+    monkeypatch.setattr(settings, "WORKER_COUNT", 1)
+    monkeypatch.setattr(settings, "WORKER_STANDBY_COUNT", 0)
+    monkeypatch.setattr(execution, "_worker_pool", None)
+    monkeypatch.setattr(execution, "_trusted_worker_pool", None)
+    executor = LocalExecutor()
+    yield executor
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_client_runs_calculations_in_service(local_executor, socket_path):
+    server = ExecutorServer(local_executor, socket_path)
+    await server.start()
+    client = ExecutorClient(socket_path)
+    try:
+        result = await client.execute(SCRIPT, timeout=10.0)
+        assert result["success"], result.get("error")
+        assert result["results"]["area"] == pytest.approx(12.566, rel=1e-3)
+        assert "executor_transfer" in result["timings"]
+
+        # The service learns the sheet's sources on its first run
+        handle = client.prepare(*split_script(SCRIPT))
+        for r in (1, 3):
+            result = await client.execute_prepared(handle, {"r": r}, timeout=10.0)
+            assert result["success"], result.get("error")
+            assert result["results"]["area"] == pytest.approx(3.14159 * r * r, rel=1e-3)
+
+        with pytest.raises(ValueError):
+            await client.execute(SCRIPT, projection="everything")
+
+        [(labels, stats)] = await client.pool_stats()
+        assert labels == {"pool": "default"}
+        assert stats["workers"] == 1
+    finally:
+        client.shutdown()
+        server.close()
+
+
+class FailingExecutor:
+    """Knows every handle, but its calculations fail with a KeyError."""
+
+    def __init__(self):
+        self.prepared = 0
+
+    def prepare(self, definitions, entry_point):
+        self.prepared += 1
+
+    async def execute_prepared(self, handle, input_overrides, **kwargs):
+        return {}[input_overrides["missing"]]
+
+
+@pytest.mark.asyncio
+async def test_service_only_asks_for_sources_of_unknown_handles(socket_path):
+    executor = FailingExecutor()
+    server = ExecutorServer(executor, socket_path)
+    await server.start()
+    client = ExecutorClient(socket_path)
+    try:
+        handle = client.prepare(*split_script(SCRIPT))
+        result = await client.execute_prepared(handle, {"missing": "r"})
+        assert not result["success"]
+        assert "KeyError" in result["error"]
+        # A KeyError raised by the calculation is not mistaken for an unknown handle
+        assert executor.prepared == 0
+    finally:
+        client.shutdown()
+        server.close()
+
+
+@pytest.mark.asyncio
+async def test_client_reports_unavailable_service(socket_path):
+    client = ExecutorClient(socket_path)
+    with pytest.raises(ExecutorUnavailableError):
+        await client.execute(SCRIPT)
+
+
+def _unused_address() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"127.0.0.1:{sock.getsockname()[1]}"
+
+
+@pytest.mark.asyncio
+async def test_registry_fails_over_to_healthy_node(local_executor):
+    with pytest.raises(ValueError):
+        # Over TCP, clients must authenticate before anything they send is unpickled
+        await ExecutorServer(local_executor, "127.0.0.1:0").start()
+
+    server = ExecutorServer(local_executor, "127.0.0.1:0", token="secret")
+    await server.start()
+    live = server.listening_on
+    down = _unused_address()
+    registry = ExecutorRegistry([down, live], token="secret", health_interval=60)
+    try:
+        handle = registry.prepare(*split_script(SCRIPT))
+        # Keys that rank the node that is down first fail over to the live one
+        for key in ("a", "b", "c", "d"):
+            result = await registry.execute_prepared(handle, {"r": 1}, timeout=10.0, affinity=key)
+            assert result["success"], result.get("error")
+        down_node, live_node = registry.nodes
+        assert not down_node.healthy
+        assert live_node.healthy
+
+        await registry.check_health(live_node)
+        assert live_node.capacity["max_workers"] >= 1
+        assert registry.stats()["failovers"] == down_node.failures
+        assert [labels for labels, _ in await registry.pool_stats()] == [{"node": live, "pool": "default"}]
+
+        with pytest.raises(ExecutorUnavailableError):
+            await ExecutorClient(live, token="wrong").execute(SCRIPT)
+    finally:
+        registry.shutdown()
+        server.close()
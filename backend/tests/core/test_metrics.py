@@ -0,0 +1,33 @@
+from src.core.metrics import Histogram, render_samples, timed
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("test_seconds", "Test histogram.", "phase", buckets=(0.1, 1))
+    histogram.observe("exec", 0.05)
+    histogram.observe("exec", 0.5)
+    histogram.observe("exec", 5)
+
+    lines = histogram.render()
+    assert lines[:2] == ["# HELP test_seconds Test histogram.", "# TYPE test_seconds histogram"]
+    assert 'test_seconds_bucket{phase="exec",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{phase="exec",le="1"} 2' in lines
+    assert 'test_seconds_bucket{phase="exec",le="+Inf"} 3' in lines
+    assert 'test_seconds_sum{phase="exec"} 5.550000' in lines
+    assert 'test_seconds_count{phase="exec"} 3' in lines
+
+
+def test_timed_accumulates_per_phase():
+    timings = {}
+    with timed(timings, "compile"):
+        pass
+    first = timings["compile"]
+    with timed(timings, "compile"):
+        pass
+    assert timings["compile"] >= first
+    assert list(timings) == ["compile"]
+
+
+def test_samples_render_with_labels():
+    lines = render_samples("test_total", "counter", "Test counter.", [({"pool": "default"}, 3), ({}, 1)])
+    assert lines[:2] == ["# HELP test_total Test counter.", "# TYPE test_total counter"]
+    assert lines[2:] == ['test_total{pool="default"} 3', "test_total 1"]
@@ -20,6 +20,8 @@ async function request<T = any>(
   try {
     res = await fetch(url, options);
   } catch (e: any) {
+    // Superseded requests are aborted on purpose
+    if (e.name === 'AbortError') throw e;
     // Network errors (e.g. offline)
     const msg = e.message || 'Network error';
     toast.error(msg);
@@ -423,11 +425,18 @@ export const api = {
   async calculatePreview(
     inputs: Record<string, { value: any }>,
     graph: Partial<Sheet>,
+    options: { signal?: AbortSignal; sessionId?: string } = {},
   ): Promise<{ results: Record<string, NodeResult>; error?: string }> {
+    const headers: Record<string, string> = {
+      'Content-Type': 'application/json',
+    };
+    // The backend cancels the previous calculation of the same session
+    if (options.sessionId) headers['X-Calculation-Session'] = options.sessionId;
     return request(`${API_BASE}/api/v1/calculate/`, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers,
       body: JSON.stringify({ inputs, graph }),
+      signal: options.signal,
     });
   },
 
@@ -571,6 +580,9 @@ export interface NodeResult {
   is_computable?: boolean;
   is_dependency_error?: boolean;
   error?: string;
+  stdout?: string;
+  profile?: { wall_seconds: number; cpu_seconds: number; peak_bytes?: number };
+  cached?: boolean;
   nodes?: Record<string, NodeResult>;
 }
 
@@ -1,5 +1,6 @@
-import { useCallback, useState } from 'react';
+import { useCallback, useRef, useState } from 'react';
 import toast from 'react-hot-toast';
+import { v4 as uuidv4 } from 'uuid';
 import { api, type NodeResult } from '@/core/api';
 import { InputControl, type ParascopeNode } from '@/core/rete';
 import { validateGraphConnectivity } from '@/core/utils';
@@ -23,6 +24,9 @@ export const useSheetCalculation = (editor: Editor | null | undefined) => {
     NodeResult
   > | null>(null);
   const [errorNodeId, setErrorNodeId] = useState<string | null>(null);
+  // A newer preview aborts the previous request so the backend stops computing it
+  const previewControllerRef = useRef<AbortController | null>(null);
+  const sessionIdRef = useRef(uuidv4());
 
   const applyCalculationResult = useCallback(
     (result: Record<string, NodeResult>) => {
@@ -127,23 +131,35 @@ export const useSheetCalculation = (editor: Editor | null | undefined) => {
         if (!force) return;
       }
 
+      previewControllerRef.current?.abort();
+      const controller = new AbortController();
+      previewControllerRef.current = controller;
+
       setIsCalculating(true);
       setLastResult(null);
       try {
-        const response = await api.calculatePreview(inputs, graph);
+        const response = await api.calculatePreview(inputs, graph, {
+          signal: controller.signal,
+          sessionId: sessionIdRef.current,
+        });
         if (response.error) {
           toast.error(`Execution Error: ${response.error}`);
         }
         applyCalculationResult(response.results);
         return response.results;
       } catch (e: any) {
+        // Superseded by a newer preview
+        if (controller.signal.aborted) return;
         console.error(e);
         if (e.nodeId) {
           setErrorNodeId(e.nodeId);
         }
         // Don't throw, just log/display error (preview shouldn't block UI)
       } finally {
-        setIsCalculating(false);
+        if (previewControllerRef.current === controller) {
+          previewControllerRef.current = null;
+          setIsCalculating(false);
+        }
       }
     },
     [applyCalculationResult, editor],
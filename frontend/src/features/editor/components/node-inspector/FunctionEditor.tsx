@@ -44,6 +44,18 @@ export const FunctionEditor: React.FC<FunctionEditorProps> = ({
         </small>
       </div>
 
+      <div className="form-group checkbox-group">
+        <label>
+          <input
+            type="checkbox"
+            checked={!!data.impure}
+            onChange={(e) => setData({ ...data, impure: e.target.checked })}
+            disabled={isGenerating}
+          />
+          <span>Impure (never reuse cached results)</span>
+        </label>
+      </div>
+
       <div className="io-section">
         <PortsEditor
           title="Inputs"
@@ -1,5 +1,12 @@
+import hashlib
+import io
+import pickle
+import time
 import traceback
-from typing import Any, Dict, List, Optional, Union
+import tracemalloc
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple, Union
 
 import networkx as nx
 
@@ -213,12 +220,180 @@ class ValidationResult:
         self.value = value
 
 
+class OutputCapture(io.TextIOBase):
+    """
+    Collects what nodes print, separately per node and up to `limit` bytes each.
+    Output beyond the limit is dropped and marked as truncated.
+    Output printed outside of any node is kept under the key None.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(0, limit)
+        self._stack: List[Optional[str]] = [None]  # Node currently running, innermost last
+        self._chunks: Dict[Optional[str], List[str]] = {}
+        self._sizes: Dict[Optional[str], int] = {}
+        self._truncated: Set[Optional[str]] = set()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        key = self._stack[-1]
+        if key in self._truncated:
+            return len(text)
+
+        size = self._sizes.get(key, 0)
+        data = text.encode("utf-8", "replace")
+        if size + len(data) > self.limit:
+            # Keep what fits; a split multi-byte character is dropped
+            text = data[: self.limit - size].decode("utf-8", "ignore")
+            data = text.encode("utf-8")
+            self._truncated.add(key)
+        if text:
+            self._chunks.setdefault(key, []).append(text)
+            self._sizes[key] = size + len(data)
+        return len(text)
+
+    @contextmanager
+    def node(self, node_id: str) -> Iterator[None]:
+        """Attributes output printed inside the block to `node_id`."""
+        self._stack.append(node_id)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+
+    def getvalue(self, key: Optional[str] = None) -> str:
+        text = "".join(self._chunks.get(key, ()))
+        if key in self._truncated:
+            text += f"\n[output truncated at {self.limit} bytes]\n"
+        return text
+
+    def take(self, key: Optional[str]) -> Optional[str]:
+        """Returns and forgets the output of `key`, or None if it printed nothing."""
+        text = self.getvalue(key)
+        self._chunks.pop(key, None)
+        self._sizes.pop(key, None)
+        self._truncated.discard(key)
+        return text or None
+
+
+class NodeProfiler:
+    """
+    Measures wall time, CPU time and, while tracemalloc is tracing, the peak allocation of each node.
+    Nodes of nested sheets are measured on their own and also count towards the sheet node running them.
+    """
+
+    def __init__(self):
+        self._profiles: Dict[str, Dict[str, Any]] = {}
+        # Per running node: traced memory at its start, and the highest peak seen before the latest reset
+        self._frames: List[List[int]] = []
+
+    @contextmanager
+    def node(self, node_id: str) -> Iterator[None]:
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._frames:
+                self._frames[-1][1] = max(self._frames[-1][1], peak)
+            # Peaks are global; the enclosing node keeps what it saw so far in its frame
+            tracemalloc.reset_peak()
+            frame = [current, current]
+            self._frames.append(frame)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            profile: Dict[str, Any] = {
+                "wall_seconds": time.perf_counter() - wall_start,
+                "cpu_seconds": time.process_time() - cpu_start,
+            }
+            if tracing:
+                _, peak = tracemalloc.get_traced_memory()
+                self._frames.pop()
+                profile["peak_bytes"] = max(0, max(frame[1], peak) - frame[0])
+                if self._frames:
+                    self._frames[-1][1] = max(self._frames[-1][1], peak)
+            self._profiles[node_id] = profile
+
+    def take(self, node_id: str) -> Optional[Dict[str, Any]]:
+        return self._profiles.pop(node_id, None)
+
+
+class NodeMemo:
+    """
+    Least recently used results of pure function nodes, keyed by the node's code hash and its arguments.
+    Results are stored pickled, so every hit returns a fresh copy and the total size stays below `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max(0, max_bytes)
+        self._entries: OrderedDict[bytes, bytes] = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, code_hash: str, kwargs: Dict[str, Any]) -> Optional[bytes]:
+        """Returns the memo key of a call, or None if its arguments cannot be pickled."""
+        try:
+            data = pickle.dumps((code_hash, sorted(kwargs.items())), protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return None
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def get(self, key: bytes) -> Tuple[bool, Any]:
+        blob = self._entries.get(key)
+        if blob is None:
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, pickle.loads(blob)
+
+    def put(self, key: bytes, value: Any):
+        try:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return
+        size = len(key) + len(blob)
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(key) + len(old)
+        self._entries[key] = blob
+        self._size += size
+        while self._size > self.max_bytes:
+            old_key, old_blob = self._entries.popitem(last=False)
+            self._size -= len(old_key) + len(old_blob)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
 class SheetBase:
     """
     Base class for all generated Sheet classes.
     Handles storage of results, input injection, and validation helpers.
     """
 
+    # Set by the host to collect what each node prints; the output is stored in the node's result
+    output_capture: Optional[OutputCapture] = None
+    # Set by the host to profile each node; the profile is stored in the node's result
+    profiler: Optional[NodeProfiler] = None
+    # Set by the host to reuse results of function nodes the generator marked as pure (with a code_hash).
+    # Private, so the guards keep sheet code from reading or poisoning entries of other sheets
+    _node_memo: Optional[NodeMemo] = None
+
     def __init__(self, input_overrides: Dict[str, Any] = None):
         self.input_overrides = input_overrides or {}
         self.results: Dict[str, Dict[str, Any]] = {}
@@ -232,6 +407,7 @@ class SheetBase:
         if metadata:
             res.update(metadata)
         self.results[node_id] = res
+        self._attach_observations(node_id)
 
     def register_instance(self, node_id: str, instance: "SheetBase"):
         """Register a nested sheet instance for state inspection"""
@@ -249,6 +425,45 @@ class SheetBase:
             "error": error,
             "internal_error": internal_error or error,
         }
+        self._attach_observations(node_id)
+
+    def _attach_observations(self, node_id: str):
+        if self.output_capture is not None:
+            output = self.output_capture.take(node_id)
+            if output:
+                self.results[node_id]["stdout"] = output
+        if self.profiler is not None:
+            profile = self.profiler.take(node_id)
+            if profile:
+                self.results[node_id]["profile"] = profile
+
+    @contextmanager
+    def _observing(self, node_id: str) -> Iterator[None]:
+        with ExitStack() as stack:
+            if self.output_capture is not None:
+                stack.enter_context(self.output_capture.node(node_id))
+            if self.profiler is not None:
+                stack.enter_context(self.profiler.node(node_id))
+            yield
+
+    def _call_node(self, cfg: Dict[str, Any], method: Any, kwargs: Dict[str, Any]) -> Tuple[Any, bool]:
+        """Calls a node method, serving pure function nodes from the memo. Also returns whether it was cached."""
+        code_hash = cfg.get("code_hash")
+        key = self._node_memo.key(code_hash, kwargs) if self._node_memo is not None and code_hash else None
+        if key is not None:
+            found, res = self._node_memo.get(key)
+            if found:
+                return res, True
+
+        if self.output_capture is None and self.profiler is None:
+            res = method(**kwargs)
+        else:
+            with self._observing(cfg["id"]):
+                res = method(**kwargs)
+
+        if key is not None:
+            self._node_memo.put(key, res)
+        return res, False
 
     def get_value(self, node_id: str, port: str = None):
         """Retrieve a value from a previous node's output"""
@@ -417,11 +632,13 @@ class SheetBase:
                     kwargs[arg] = val
 
                 # Call Method
-                res = method(**kwargs)
+                res, cached = self._call_node(cfg, method, kwargs)
 
                 # Register Result (Handle dicts vs usage)
                 meta = self.node_metadata.get(node_id)
                 self.register_result(node_id, res, metadata=meta)
+                if cached:
+                    self.results[node_id]["cached"] = True
 
             except (DependencyError, ValueValidationError) as e:
                 # Upstream failure or Validation failure
@@ -444,6 +661,7 @@ class SheetBase:
                     if meta:
                         res_obj.update(meta)
                     self.results[node_id] = res_obj
+                    self._attach_observations(node_id)
                 elif is_dependency:
                     self.register_error(node_id, error=msg, internal_error="Dependency failed")
                 else: